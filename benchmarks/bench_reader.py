@@ -0,0 +1,76 @@
+"""Micro-benchmark for reading large exiftool responses.
+
+Compares the reader used by ``ExifTool.execute`` with the previous
+``output += os.read(fd, block_size)`` loop on responses of several
+megabytes pushed through a pipe, which is how a ``-j`` batch for a few
+thousand files arrives.
+
+    python benchmarks/bench_reader.py --sizes 1 4 16
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import exiftool
+
+
+def legacy_read(fd):
+    output = b""
+    while not output[-32:].strip().endswith(exiftool.sentinel):
+        output += os.read(fd, exiftool.block_size)
+    return output.strip()[:-len(exiftool.sentinel)]
+
+
+def buffered_read(fd):
+    buffer = exiftool._OutputBuffer()
+    while not buffer.read_from(fd):
+        pass
+    return buffer.getvalue()
+
+
+def make_response(size):
+    record = b'{"SourceFile": "/photos/2019/IMG_0001.JPG", "XMP:Subject": ["Holiday", "Beach", "Family"]},\n'
+    count = max(1, size // len(record))
+    return b"[" + record * count + b"{}]\n" + exiftool.sentinel + b"\n"
+
+
+def time_reader(reader, response):
+    read_fd, write_fd = os.pipe()
+
+    def write():
+        with os.fdopen(write_fd, "wb") as pipe:
+            pipe.write(response)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    start = time.perf_counter()
+    result = reader(read_fd)
+    elapsed = time.perf_counter() - start
+    writer.join()
+    os.close(read_fd)
+    return elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 16],
+                        help="response sizes in MB")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'size (MB)':>10} {'legacy (s)':>12} {'buffered (s)':>13} {'speedup':>8}")
+    for size in args.sizes:
+        response = make_response(int(size * 1024 * 1024))
+        legacy = min(time_reader(legacy_read, response)[0] for _ in range(args.repeat))
+        buffered = min(time_reader(buffered_read, response)[0] for _ in range(args.repeat))
+        if time_reader(legacy_read, response)[1] != time_reader(buffered_read, response)[1]:
+            sys.exit("readers returned different output")
+        print(f"{size:>10g} {legacy:>12.4f} {buffered:>13.4f} {legacy / buffered:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
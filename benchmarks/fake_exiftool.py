@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""A stand-in for exiftool, so benchmarks run without Perl.
+
+It speaks the part of the exiftool protocol the pipeline uses:
+``-stay_open True -@ -`` batches ended by ``-execute[NUM]``, ``-@ ARGFILE``,
+``-echo4``, ``-r``, ``-ext``/``--ext``, ``-j`` output and ``-json=FILE``
+imports, with ``-progress`` lines while writing. Only the XMP lists of
+files made by synthetic_library.py are read and written.
+
+Set FAKE_EXIFTOOL_DELAY to a number of seconds per file to simulate slow
+storage, and FAKE_EXIFTOOL_HANG to part of a file name to make it hang on
+the files whose path contains it, as exiftool can on a corrupt video.
+
+    python -m cli --exiftool benchmarks/fake_exiftool.py scan /tmp/library
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_library import read_jpeg_xmp, parse_xmp, replace_jpeg_xmp
+
+DELAY = float(os.environ.get("FAKE_EXIFTOOL_DELAY", "0"))
+HANG = os.environ.get("FAKE_EXIFTOOL_HANG")
+VALUE_OPTIONS = {"-ext", "--ext", "-extension", "--extension", "-charset", "-api", "-d", "-p"}
+
+
+def expand_argfiles(args):
+    expanded = []
+    while args:
+        arg = args.pop(0)
+        if arg == "-@" and args:
+            with open(args.pop(0), encoding="utf-8") as f:
+                args[:0] = [line.rstrip("\n") for line in f if line.strip()]
+        else:
+            expanded.append(arg)
+    return expanded
+
+
+def visit(path):
+    time.sleep(DELAY)
+    while HANG and HANG in path:
+        time.sleep(60)
+
+
+def list_targets(targets, recursive, include, exclude):
+    for target in targets:
+        if not os.path.isdir(target):
+            yield target
+            continue
+        for root, dirs, names in os.walk(target):
+            dirs[:] = sorted(name for name in dirs if not name.startswith(".")) if recursive else []
+            for name in sorted(names):
+                extension = os.path.splitext(name)[1].lstrip(".").lower()
+                if name.startswith(".") or extension in exclude or (include and extension not in include):
+                    continue
+                if extension in ("jpg", "jpeg"):
+                    yield os.path.join(root, name)
+
+
+def run(args, out, err):
+    options, targets = [], []
+    include, exclude = set(), set()
+    echo = []
+    args = expand_argfiles(args)
+    while args:
+        arg = args.pop(0)
+        lower = arg.lower()
+        if lower.startswith("-echo") and args:
+            value = args.pop(0)
+            if lower in ("-echo2", "-echo4"):
+                echo.append(value)
+        elif lower in VALUE_OPTIONS and args:
+            value = args.pop(0).lstrip(".").lower()
+            if lower in ("--ext", "--extension"):
+                exclude.add(value)
+            elif lower in ("-ext", "-extension"):
+                include.add(value)
+        elif arg.startswith("-"):
+            options.append(arg)
+        else:
+            targets.append(arg)
+
+    recursive = "-r" in options
+    group = "XMP:" if "-G" in options else ""
+    imports = [option[len("-json="):] for option in options if option.startswith("-json=")]
+    files = list(list_targets(targets, recursive, include, exclude))
+
+    if imports:
+        with open(imports[0], encoding="utf-8") as f:
+            updates = {record["SourceFile"]: record for record in json.load(f)}
+        updated = 0
+        for number, path in enumerate(files, 1):
+            visit(path)
+            update = updates.get(path)
+            if update is None:
+                err.write(f"Warning: No SourceFile '{path}' in imported JSON database\n")
+                continue
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                err.write(f"Error: File not found - {path}\n")
+                continue
+            span = read_jpeg_xmp(data)
+            tags = parse_xmp(data[span[0]:span[1]]) if span else {}
+            for key, value in update.items():
+                name = key.split(":")[-1]
+                if key == "SourceFile":
+                    continue
+                if value == "-" and "-f" in options:
+                    tags.pop(name, None)
+                else:
+                    tags[name] = value if isinstance(value, list) else [value]
+            with open(path, "wb") as f:
+                f.write(replace_jpeg_xmp(data, tags))
+            updated += 1
+            if "-progress" in options:
+                out.write(f"======== {path} [{number}/{len(files)}]\n")
+                out.flush()
+        out.write(f"    {updated} image files updated\n")
+    else:
+        records = []
+        for number, path in enumerate(files, 1):
+            visit(path)
+            if "-progress" in options:
+                err.write(f"======== {path} [{number}/{len(files)}]\n")
+                err.flush()
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                err.write(f"Error: File not found - {path}\n")
+                continue
+            span = read_jpeg_xmp(data)
+            record = {"SourceFile": path}
+            if span:
+                for name, values in parse_xmp(data[span[0]:span[1]]).items():
+                    record[group + name] = values
+            records.append(record)
+        if records:
+            out.write(json.dumps(records, indent=2) + "\n")
+
+    for text in echo:
+        err.write(text + "\n")
+
+
+def main():
+    argv = sys.argv[1:]
+    if argv[:2] != ["-stay_open", "True"]:
+        run(argv, sys.stdout, sys.stderr)
+        return
+    common = argv[argv.index("-common_args") + 1:] if "-common_args" in argv else []
+    batch = []
+    for line in sys.stdin:
+        arg = line.rstrip("\n")
+        if arg == "-execute" or arg.startswith("-execute") and arg[len("-execute"):].isdigit():
+            run(batch + common, sys.stdout, sys.stderr)
+            sys.stdout.write("{ready%s}\n" % arg[len("-execute"):])
+            sys.stdout.flush()
+            sys.stderr.flush()
+            batch = []
+        elif batch[-1:] == ["-stay_open"] and arg == "False":
+            return
+        else:
+            batch.append(arg)
+
+
+if __name__ == "__main__":
+    main()
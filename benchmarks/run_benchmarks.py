@@ -0,0 +1,168 @@
+"""Measure the throughput of each pipeline stage on a synthetic library.
+
+Every stage runs in its own Python process against fake_exiftool.py (or a
+real exiftool with --exiftool), so its peak RSS is measured on its own.
+The report gives files/sec and peak RSS per stage and is saved as JSON,
+so two runs can be compared:
+
+    python benchmarks/run_benchmarks.py --output before.json
+    python benchmarks/run_benchmarks.py --output after.json --compare before.json
+
+Stages: scan (cold), rescan (warm manifest), replace (process pool),
+replace_in_memory (process_json_data on parsed records, i.e. the matching
+work alone), write, and fused on a freshly generated library.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+FAKE_EXIFTOOL = os.path.join(BENCHMARK_DIR, "fake_exiftool.py")
+STAGES = ["scan", "rescan", "replace", "replace_in_memory", "write", "fused"]
+SCAN_COMMAND = "exiftool -r -j --ext .json --ext .txt -xmp:Subject -xmp:PersonInImage"
+
+
+def _peak_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_stage(stage, library, exiftool, processes, pattern):
+    """Run one stage in this process and return its measurements."""
+    from exiftool import ExifToolPool
+    from matcher import TagMatcher
+    import pipeline
+    import fused
+
+    matcher = TagMatcher([pattern], [])
+    start = time.perf_counter()
+    with ExifToolPool(processes, exiftool, common_args=[]) as pool:
+        if stage in ("scan", "rescan"):
+            pipeline.run_scan(library, SCAN_COMMAND, pool, incremental=stage == "rescan")
+            num_files = sum(1 for _ in _library_files(library))
+        elif stage == "replace":
+            num_files = 0
+            for path in pipeline.get_list_of_json_files(library):
+                with open(path, encoding="utf-8") as f:
+                    num_files += len(json.load(f))
+            start = time.perf_counter()
+            pipeline.run_replace(library, matcher)
+        elif stage == "replace_in_memory":
+            data = []
+            for path in pipeline.get_list_of_json_files(library):
+                with open(path, encoding="utf-8") as f:
+                    data.extend(json.load(f))
+            num_files = len(data)
+            start = time.perf_counter()
+            pipeline.process_json_data(data, matcher)
+        elif stage == "write":
+            plan, _ = pipeline.build_write_plan(library)
+            num_files = len(plan)
+            pipeline.run_write(library, pool)
+        elif stage == "fused":
+            num_files = sum(1 for _ in _library_files(library))
+            fused.run_fused(library, SCAN_COMMAND, pool, matcher)
+        else:
+            raise ValueError(f"Unknown stage {stage}")
+    seconds = time.perf_counter() - start
+    return {
+        "files": num_files,
+        "seconds": round(seconds, 4),
+        "files_per_sec": round(num_files / seconds, 1) if seconds else None,
+        "peak_rss_mb": round(_peak_rss_mb(resource.RUSAGE_SELF), 1),
+        "children_peak_rss_mb": round(_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+    }
+
+
+def _library_files(library):
+    for root, _, names in os.walk(library):
+        for name in names:
+            if name.endswith(".jpg"):
+                yield os.path.join(root, name)
+
+
+def run_stage_process(stage, library, args):
+    # Quiet the pipeline's per-batch prints; the result is the last line
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-stage", stage, "--library", library,
+                             "--exiftool", args.exiftool, "--pattern", args.pattern]
+                            + (["--processes", str(args.processes)] if args.processes else []),
+                            stdout=subprocess.PIPE, check=True)
+    return json.loads(result.stdout.decode("utf-8").strip().splitlines()[-1])
+
+
+def print_report(report, baseline=None):
+    print(f"{'stage':<18} {'files':>8} {'seconds':>9} {'files/sec':>10} {'peak MB':>8} {'children MB':>12}"
+          + ("   change" if baseline else ""))
+    for stage, result in report["stages"].items():
+        line = (f"{stage:<18} {result['files']:>8} {result['seconds']:>9.3f} {result['files_per_sec'] or 0:>10.1f} "
+                f"{result['peak_rss_mb']:>8.1f} {result['children_peak_rss_mb']:>12.1f}")
+        previous = (baseline or {}).get("stages", {}).get(stage)
+        if previous and previous.get("files_per_sec") and result["files_per_sec"]:
+            line += f"   {(result['files_per_sec'] / previous['files_per_sec'] - 1) * 100:+.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--events", type=int, default=10)
+    parser.add_argument("--images", type=int, default=100)
+    parser.add_argument("--keywords", type=int, default=8)
+    parser.add_argument("--match-rate", type=float, default=0.05)
+    parser.add_argument("--pattern", default="Face_")
+    parser.add_argument("--exiftool", default=FAKE_EXIFTOOL)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--output", help="save the report as JSON")
+    parser.add_argument("--compare", help="JSON report of an earlier run")
+    parser.add_argument("--run-stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--library", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        result = run_stage(args.run_stage, args.library, args.exiftool, args.processes, args.pattern)
+        print(json.dumps(result))
+        return
+
+    from synthetic_library import generate
+
+    library_options = {"years": args.years, "events": args.events, "images": args.images,
+                       "keywords": args.keywords, "match_rate": args.match_rate, "pattern": args.pattern}
+    report = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+              "exiftool": args.exiftool, "processes": args.processes or os.cpu_count(),
+              "library": library_options, "stages": {}}
+    temp_root = tempfile.mkdtemp(prefix="remove-tag-bench-")
+    try:
+        library = os.path.join(temp_root, "library")
+        generate(library, **library_options)
+        for stage in args.stages:
+            if stage == "fused":
+                # The staged run already cleaned the first library
+                library = os.path.join(temp_root, "fused")
+                generate(library, **library_options)
+            report["stages"][stage] = run_stage_process(stage, library, args)
+    finally:
+        shutil.rmtree(temp_root, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
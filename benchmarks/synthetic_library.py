@@ -0,0 +1,132 @@
+"""Generate a synthetic photo library for benchmarks.
+
+The library has year folders with event subfolders of small JPEG files.
+Each file carries an XMP packet with a dc:subject keyword list and an
+Iptc4xmpExt:PersonInImage list. A configurable share of the files holds
+a keyword that starts with the removal pattern (``Face_`` by default).
+
+    python benchmarks/synthetic_library.py /tmp/library --years 5 --events 20 --images 100
+
+The XMP helpers here are shared with fake_exiftool.py.
+"""
+import argparse
+import os
+import random
+import re
+import struct
+from xml.sax.saxutils import escape, unescape
+
+XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+
+# XMP list tags as (tag name, element name)
+XMP_TAGS = (("Subject", "dc:subject"), ("PersonInImage", "Iptc4xmpExt:PersonInImage"))
+
+_PACKET = """<?xpacket begin="﻿" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/"
+ xmlns:Iptc4xmpExt="http://iptc.org/std/Iptc4xmpExt/2008-02-29/">
+{lists}
+</rdf:Description>
+</rdf:RDF>
+</x:xmpmeta>
+<?xpacket end="w"?>"""
+
+
+def build_xmp(tags):
+    # tags maps tag names from XMP_TAGS to lists of strings
+    lists = []
+    for name, element in XMP_TAGS:
+        values = tags.get(name)
+        if values:
+            items = "".join(f"<rdf:li>{escape(value)}</rdf:li>" for value in values)
+            lists.append(f"<{element}><rdf:Bag>{items}</rdf:Bag></{element}>")
+    return _PACKET.format(lists="\n".join(lists)).encode("utf-8")
+
+
+def parse_xmp(packet):
+    text = packet.decode("utf-8", "replace")
+    tags = {}
+    for name, element in XMP_TAGS:
+        match = re.search(f"<{element}><rdf:Bag>(.*?)</rdf:Bag></{element}>", text, re.S)
+        if match:
+            tags[name] = [unescape(value) for value in re.findall(r"<rdf:li>(.*?)</rdf:li>", match.group(1), re.S)]
+    return tags
+
+
+def build_jpeg(tags, padding=0):
+    # SOI, an APP1 XMP segment, a stand-in scan segment with padding
+    # bytes as image data, then EOI
+    payload = XMP_HEADER + build_xmp(tags)
+    app1 = b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+    sos = b"\xff\xda" + struct.pack(">H", 2)
+    return b"\xff\xd8" + app1 + sos + b"\x00" * padding + b"\xff\xd9"
+
+
+def read_jpeg_xmp(data):
+    # Returns (start, end) of the XMP packet in a JPEG built by build_jpeg
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        if marker == 0xDA:
+            break
+        body = pos + 4
+        if marker == 0xE1 and data[body:body + len(XMP_HEADER)] == XMP_HEADER:
+            return body + len(XMP_HEADER), pos + 2 + length
+        pos += 2 + length
+    return None
+
+
+def replace_jpeg_xmp(data, tags):
+    span = read_jpeg_xmp(data)
+    payload = XMP_HEADER + build_xmp(tags)
+    app1 = b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+    if span is None:
+        return data[:2] + app1 + data[2:]
+    start = span[0] - len(XMP_HEADER) - 4
+    return data[:start] + app1 + data[span[1]:]
+
+
+def generate(root, years=5, events=10, images=100, keywords=8, people=3, match_rate=0.05, pattern="Face_",
+             padding=2048, seed=1):
+    """Write the library and return the number of files and of matching files."""
+    rng = random.Random(seed)
+    vocabulary = [f"Keyword{i}" for i in range(500)]
+    names = [f"Person {i}" for i in range(100)]
+    num_files = num_matching = 0
+    for year in range(2000, 2000 + years):
+        for event in range(events):
+            folder = os.path.join(root, str(year), f"Event {event:03d}")
+            os.makedirs(folder, exist_ok=True)
+            for image in range(images):
+                tags = {"Subject": rng.sample(vocabulary, keywords), "PersonInImage": rng.sample(names, people)}
+                if rng.random() < match_rate:
+                    tags["Subject"][rng.randrange(keywords)] = f"{pattern}{rng.randrange(1000)}"
+                    num_matching += 1
+                with open(os.path.join(folder, f"IMG_{image:05d}.jpg"), "wb") as f:
+                    f.write(build_jpeg(tags, padding))
+                num_files += 1
+    return num_files, num_matching
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("root")
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--events", type=int, default=10, help="event folders per year")
+    parser.add_argument("--images", type=int, default=100, help="images per event folder")
+    parser.add_argument("--keywords", type=int, default=8, help="keywords per image")
+    parser.add_argument("--people", type=int, default=3, help="people per image")
+    parser.add_argument("--match-rate", type=float, default=0.05, help="share of images holding the pattern")
+    parser.add_argument("--pattern", default="Face_")
+    parser.add_argument("--padding", type=int, default=2048, help="bytes of fake image data per file")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    num_files, num_matching = generate(args.root, args.years, args.events, args.images, args.keywords, args.people,
+                                       args.match_rate, args.pattern, args.padding, args.seed)
+    print(f"{num_files} files written, {num_matching} with '{args.pattern}'")
+
+
+if __name__ == "__main__":
+    main()
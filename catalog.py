@@ -0,0 +1,242 @@
+"""SQLite catalog of the scanned metadata.
+
+An optional alternative to the output.json and modified.json files. The
+scan stage loads every folder's records into the catalog. The replace
+stage runs the rules once per distinct tag value and marks the matching
+rows. The write stage reads only the marked rows:
+
+    catalog = Catalog("library.db")
+    run_scan(folder, command, pool, catalog=catalog)
+    catalog.apply_rules(ruleset)
+    run_write(folder, pool, catalog=catalog)
+
+Every value is one row of tag_values, so a list tag has one row per item.
+Indexes on the tag and the value answer "which files still carry this
+keyword" without reading the library:
+
+    catalog.find_files("Face_0123")
+
+Values that aren't strings or numbers (structures, booleans) are stored
+as JSON and are never matched by rules.
+"""
+import os
+import json
+import sqlite3
+import threading
+from rules import as_ruleset, DROP, DELETE_VALUE
+from interning import Interner
+
+# tag_values.state
+UNCHANGED, CHANGED, DROPPED = 0, 1, 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    folder TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_folder ON files (folder);
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS tag_values (
+    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    tag_id INTEGER NOT NULL REFERENCES tags (id),
+    position INTEGER NOT NULL,
+    is_list INTEGER NOT NULL,
+    is_json INTEGER NOT NULL,
+    value,
+    state INTEGER NOT NULL DEFAULT 0,
+    new_value,
+    PRIMARY KEY (file_id, tag_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tag_values_tag_value ON tag_values (tag_id, value);
+CREATE INDEX IF NOT EXISTS tag_values_value ON tag_values (value);
+CREATE INDEX IF NOT EXISTS tag_values_pending ON tag_values (file_id, tag_id) WHERE state != 0;
+"""
+
+
+def _encode(value):
+    # (stored value, is_json)
+    if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        return value, 0
+    return json.dumps(value), 1
+
+
+def _decode(value, is_json):
+    return json.loads(value) if is_json else value
+
+
+class Catalog:
+    """One SQLite database for a library.
+
+    The connection is shared by the pipeline's worker threads and every
+    call holds a lock, so the catalog can be written from scan workers
+    and write batches at the same time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+        self.tag_ids = dict(self.connection.execute("SELECT name, id FROM tags"))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _tag_id(self, name):
+        tag_id = self.tag_ids.get(name)
+        if tag_id is None:
+            tag_id = self.connection.execute("INSERT INTO tags (name) VALUES (?)", (name,)).lastrowid
+            self.tag_ids[name] = tag_id
+        return tag_id
+
+    def replace_folder(self, folder, records):
+        """Replace the catalog rows of a scanned folder with its records.
+
+        Runs as one transaction, so readers see either the old or the new
+        contents of the folder. Any pending changes of its files are lost,
+        since they were found on the old metadata.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM files WHERE folder = ?", (folder,))
+            rows = []
+            for record in records:
+                path = os.path.normpath(record["SourceFile"])
+                try:
+                    file_id = self.connection.execute(
+                        "INSERT INTO files (path, folder) VALUES (?, ?)", (path, folder)).lastrowid
+                except sqlite3.IntegrityError:
+                    # The file was last scanned as part of another folder,
+                    # as happens when nested folders are scanned on their own
+                    file_id = self.connection.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()[0]
+                    self.connection.execute("UPDATE files SET folder = ? WHERE id = ?", (folder, file_id))
+                    self.connection.execute("DELETE FROM tag_values WHERE file_id = ?", (file_id,))
+                for tag, value in record.items():
+                    if tag == "SourceFile":
+                        continue
+                    tag_id = self._tag_id(tag)
+                    if isinstance(value, list):
+                        rows.extend((file_id, tag_id, position, 1) + _encode(item)
+                                    for position, item in enumerate(value))
+                    else:
+                        rows.append((file_id, tag_id, 0, 0) + _encode(value))
+            self.connection.executemany(
+                "INSERT INTO tag_values (file_id, tag_id, position, is_list, value, is_json) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def apply_rules(self, matcher):
+        """Mark the values the rules drop or change, and return their number
+        and the number of files affected.
+
+        The rules run once per distinct value of each tag with rules, and
+        the decisions are applied to all rows holding that value in one
+        statement. Earlier marks are cleared first, so running a changed
+        rule set replaces the previous result.
+        """
+        ruleset = as_ruleset(matcher)
+        decisions = []
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE tag_values SET state = 0, new_value = NULL WHERE state != 0")
+            for name, tag_id in list(self.tag_ids.items()):
+                plan = ruleset.plan_for(name)
+                for is_list, rules, chain in ((1, plan.list_rules, plan.list_chain),
+                                              (0, plan.scalar_rules, plan.scalar_chain)):
+                    if not rules:
+                        continue
+                    for (value,) in self.connection.execute(
+                            "SELECT DISTINCT value FROM tag_values "
+                            "WHERE tag_id = ? AND is_list = ? AND is_json = 0 AND typeof(value) = 'text'",
+                            (tag_id, is_list)):
+                        new_value = chain(value)
+                        if new_value is DROP:
+                            decisions.append((tag_id, is_list, value, DROPPED, None))
+                        elif new_value != value:
+                            decisions.append((tag_id, is_list, value, CHANGED, new_value))
+
+            self.connection.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS decisions (tag_id INTEGER, is_list INTEGER, value TEXT, "
+                "state INTEGER, new_value TEXT, PRIMARY KEY (tag_id, is_list, value))")
+            self.connection.execute("DELETE FROM decisions")
+            self.connection.executemany("INSERT INTO decisions VALUES (?, ?, ?, ?, ?)", decisions)
+            match = ("FROM decisions d WHERE d.tag_id = tag_values.tag_id AND d.is_list = tag_values.is_list "
+                     "AND d.value = tag_values.value")
+            self.connection.execute(
+                f"UPDATE tag_values SET state = (SELECT d.state {match}), new_value = (SELECT d.new_value {match}) "
+                "WHERE is_json = 0 AND (tag_id, is_list, value) IN (SELECT tag_id, is_list, value FROM decisions)")
+            return self.connection.execute(
+                "SELECT count(*), count(DISTINCT file_id) FROM tag_values WHERE state != 0").fetchone()
+
+    def write_plan(self):
+        """Return the pending updates as {path: (folder, record)}.
+
+        A record holds the SourceFile and the new value of every changed
+        tag: the remaining items of a list, or rules.DELETE_VALUE for a
+        dropped scalar. Only the rows of changed tags are read.
+        """
+        plan = {}
+        intern = Interner()
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT f.path, f.folder, t.name, v.is_list, v.is_json, v.value, v.state, v.new_value "
+                "FROM tag_values v JOIN files f ON f.id = v.file_id JOIN tags t ON t.id = v.tag_id "
+                "WHERE (v.file_id, v.tag_id) IN (SELECT file_id, tag_id FROM tag_values WHERE state != 0) "
+                "ORDER BY v.file_id, v.tag_id, v.position").fetchall()
+        for path, folder, tag, is_list, is_json, value, state, new_value in rows:
+            if path not in plan:
+                plan[path] = (folder, {"SourceFile": path})
+            record = plan[path][1]
+            tag = intern(tag)
+            if is_list:
+                items = record.setdefault(tag, [])
+                if state == UNCHANGED:
+                    items.append(intern(value) if not is_json else _decode(value, is_json))
+                elif state == CHANGED:
+                    items.append(intern(new_value))
+            else:
+                record[tag] = DELETE_VALUE if state == DROPPED else intern(new_value)
+        return plan
+
+    def mark_written(self, paths):
+        # The new values of these files are now on disk
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS written (path TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM written")
+            self.connection.executemany("INSERT OR IGNORE INTO written VALUES (?)", ((path,) for path in paths))
+            written = "file_id IN (SELECT f.id FROM files f JOIN written w ON w.path = f.path)"
+            self.connection.execute(f"DELETE FROM tag_values WHERE state = {DROPPED} AND {written}")
+            self.connection.execute(f"UPDATE tag_values SET value = new_value, new_value = NULL, state = 0 "
+                                    f"WHERE state = {CHANGED} AND {written}")
+
+    def find_files(self, value, tag=None, prefix=False):
+        """Return the paths of the files with a tag value equal to value, or
+        starting with it with prefix.
+
+        tag limits the search to one "Group:Tag" key. Both forms use the
+        value index.
+        """
+        if prefix:
+            # A range instead of LIKE, which can't use the index
+            condition, params = "v.value >= ? AND v.value < ?", [value, value + "\U0010ffff"]
+        else:
+            condition, params = "v.value = ?", [value]
+        if tag is not None:
+            condition += " AND v.tag_id = ?"
+            params.append(self.tag_ids.get(tag, -1))
+        with self.lock:
+            return [path for (path,) in self.connection.execute(
+                f"SELECT DISTINCT f.path FROM tag_values v JOIN files f ON f.id = v.file_id WHERE {condition} "
+                "ORDER BY f.path", params)]
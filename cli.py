@@ -0,0 +1,250 @@
+"""Run the pipeline without a display.
+
+    python -m cli scan /photos
+    python -m cli replace /photos --replace "Face_,Unknown" --keep "Family"
+    python -m cli replace /photos --rules cleanup.json
+    python -m cli write /photos
+    python -m cli all /photos --replace "Face_"
+    python -m cli --catalog photos.db all /photos --replace "Face_"
+    python -m cli --catalog photos.db find "Face_" --prefix
+    python -m cli preview /photos --replace "Face_" --keep "Family"
+
+Each stage works on the same files as the GUI buttons: output.json and
+modified.json in the year folders of the library.
+"""
+import os
+import sys
+import logging
+import argparse
+import codec
+from exiftool import ExifToolPool
+from matcher import TagMatcher, parse_pattern_list
+from rules import RuleSet
+from catalog import Catalog
+from keyword_index import KeywordIndex, format_preview
+from fused import run_fused
+from prefilter import Prefilter
+from metrics import RunMetrics
+from concurrency import AdaptiveLimiter
+import pipeline
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Remove tags from photo metadata.")
+    parser.add_argument("--exiftool", default=None, help="path of the exiftool executable")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="number of exiftool processes (default: one per CPU)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="adapt the number of busy exiftool processes (up to --processes) to the measured "
+                             "throughput and latency of the storage")
+    parser.add_argument("--max-rate", type=float, metavar="MB", default=None,
+                        help="hand at most this many MB per second to exiftool")
+    parser.add_argument("--timeout", type=float, default=pipeline.DEFAULT_TIMEOUT, metavar="SECONDS",
+                        help="kill exiftool when it is silent this long and retry its files in halves; files "
+                             "that still hang go to quarantine.txt; writes get a second more per MB of their largest "
+                             "file (default: %(default)s, 0 waits forever)")
+    parser.add_argument("--metrics-json", metavar="PATH", help="save a JSON report of per-stage and per-folder metrics")
+    parser.add_argument("--prometheus", metavar="PATH",
+                        help="save the metrics as a Prometheus textfile (e.g. for the node exporter)")
+    parser.add_argument("--profile", metavar="DIR", help="profile every worker with cProfile and save the stats in DIR")
+    parser.add_argument("--catalog", metavar="PATH",
+                        help="SQLite catalog: scan loads it, replace marks changes in it instead of writing "
+                             "modified.json, and write reads the changes from it")
+    stages = parser.add_subparsers(dest="stage", required=True)
+
+    source = argparse.ArgumentParser(add_help=False)
+    source.add_argument("--command", default=pipeline.DEFAULT_SCAN_COMMAND,
+                        help="exiftool command used to extract the tags")
+    source.add_argument("--shard-size", type=int, default=500, help="number of files per exiftool read call")
+
+    scan = argparse.ArgumentParser(add_help=False, parents=[source])
+    scan.add_argument("--full", action="store_true", help="rescan every file, ignoring the manifest cache")
+    scan.add_argument("--compression", choices=codec.COMPRESSIONS, default="none",
+                      help="compress output.json, and the modified.json made from it (zstd needs zstandard)")
+
+    patterns = argparse.ArgumentParser(add_help=False)
+    patterns.add_argument("--replace", default="", help="comma separated values to remove from list tags")
+    patterns.add_argument("--keep", default="", help="comma separated values that protect a tag value")
+    patterns.add_argument("--ignore-case", action="store_true")
+    patterns.add_argument("--whole-word", action="store_true")
+    patterns.add_argument("--regex", action="store_true", help="patterns are regular expressions")
+    patterns.add_argument("--rules", metavar="FILE",
+                          help="JSON file of per-tag rules, applied after --replace in the same pass")
+
+    replace = argparse.ArgumentParser(add_help=False, parents=[patterns])
+    replace.add_argument("--jobs", type=int, default=None,
+                         help="number of worker processes for the replace stage (default: one per CPU)")
+    replace.add_argument("--threads", action="store_true",
+                         help="run the replace stage on threads instead of worker processes")
+
+    batches = argparse.ArgumentParser(add_help=False)
+    batches.add_argument("--batch-size", type=int, default=500, help="maximum number of files per exiftool write call")
+
+    write = argparse.ArgumentParser(add_help=False, parents=[batches])
+    write.add_argument("--concurrency", type=int, default=None,
+                       help="number of batches written at the same time (default: --processes)")
+    write.add_argument("--order", choices=["bytes", "files"], default="bytes",
+                       help="start the batches with the most pending bytes or files first")
+    write.add_argument("--resume", action="store_true",
+                       help="skip files the write journal of an interrupted run already lists")
+
+    fused = argparse.ArgumentParser(add_help=False, parents=[source, patterns, batches])
+    fused.add_argument("--read-workers", type=int, default=None,
+                       help="number of exiftool readers (default: half of --processes)")
+    fused.add_argument("--write-workers", type=int, default=None,
+                       help="number of exiftool writers (default: the other half)")
+    fused.add_argument("--queue-size", type=int, default=10000,
+                       help="maximum number of records waiting for the replace filter")
+
+    prefiltered = argparse.ArgumentParser(add_help=False)
+    prefiltered.add_argument("--prefilter", action="store_true",
+                             help="don't run exiftool on JPEGs whose metadata blocks hold none of the patterns")
+
+    for name, parents, help_text in (("scan", [scan], "write output.json for every folder"),
+                                     ("replace", [replace], "write modified.json from every output.json"),
+                                     ("write", [write], "write modified.json back to the images"),
+                                     ("all", [scan, replace, write, prefiltered], "run scan, replace and write"),
+                                     ("fused", [fused, prefiltered], "scan, replace and write in one pass without "
+                                                        "intermediate JSON files"),
+                                     ("preview", [patterns], "show what the patterns would change, from the "
+                                                             "keyword index of the last scan")):
+        stage = stages.add_parser(name, parents=parents, help=help_text, conflict_handler="resolve")
+        stage.add_argument("folder", help="photo library with one folder per year")
+
+    find = stages.add_parser("find", help="list the files of the --catalog that carry a tag value")
+    find.add_argument("value")
+    find.add_argument("--tag", help="only look at this tag, e.g. XMP:Subject")
+    find.add_argument("--prefix", action="store_true", help="find values starting with value")
+    return parser
+
+
+def build_tag_matcher(args):
+    # The --replace/--keep lists, or None without --replace
+    if not parse_pattern_list(args.replace):
+        return None
+    return TagMatcher(parse_pattern_list(args.replace), parse_pattern_list(args.keep),
+                      case_insensitive=args.ignore_case, whole_word=args.whole_word, regex=args.regex)
+
+
+def build_matcher(args):
+    # The --replace/--keep lists and the --rules file as one RuleSet
+    rules = []
+    matcher = build_tag_matcher(args)
+    if matcher is not None:
+        rules += RuleSet.from_matcher(matcher).rules
+    if args.rules:
+        rules += RuleSet.load(args.rules).rules
+    if not rules:
+        raise ValueError("Give --replace, --rules or both")
+    return RuleSet(rules)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # The stages report what they skip through the logging module
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if getattr(args, "folder", None):
+        # exiftool reports files under the folder as it is given, and
+        # later stages must find them from any working directory
+        args.folder = os.path.abspath(args.folder)
+    if args.stage == "find":
+        if not args.catalog:
+            print("Error: find needs --catalog", file=sys.stderr)
+            return 2
+        with Catalog(args.catalog) as catalog:
+            for path in catalog.find_files(args.value, tag=args.tag, prefix=args.prefix):
+                print(path)
+        return 0
+
+    matcher = None
+    if args.stage in ("replace", "all", "fused", "preview"):
+        try:
+            # Without --rules the preview is broken down by pattern
+            matcher = build_matcher(args) if args.stage != "preview" or args.rules else build_tag_matcher(args)
+        except (ValueError, OSError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 2
+        if matcher is None:
+            print("Error: Give --replace, --rules or both", file=sys.stderr)
+            return 2
+
+    if args.stage in ("scan", "all"):
+        try:
+            codec.check_compression(args.compression)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 2
+
+    if args.stage == "preview":
+        try:
+            print(format_preview(KeywordIndex.load(args.folder).preview(matcher)))
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 2
+        return 0
+
+    prefilter = None
+    if getattr(args, "prefilter", False):
+        prefilter = Prefilter.for_matcher(matcher)
+        if prefilter is None:
+            print("Regex and exact patterns can't be prefiltered; reading every file", file=sys.stderr)
+
+    timeout = args.timeout or None
+    metrics = RunMetrics(profile_dir=args.profile)
+    catalog = Catalog(args.catalog) if args.catalog and args.stage != "fused" else None
+    errors = []
+    with ExifToolPool(args.processes, args.exiftool, common_args=[]) as pool:
+        def limiter():
+            # One per stage, since reads and writes take different times.
+            # Without --adaptive the limit stays at the pool size.
+            if not (args.adaptive or args.max_rate):
+                return None
+            return AdaptiveLimiter(pool.size, min_limit=1 if args.adaptive else pool.size,
+                                   bytes_per_sec=args.max_rate * 1024 * 1024 if args.max_rate else None)
+
+        if args.stage in ("scan", "all"):
+            errors += pipeline.run_scan(args.folder, args.command, pool, incremental=not args.full,
+                                        shard_size=args.shard_size, on_folder_done=lambda folder, text: print(text),
+                                        metrics=metrics, catalog=catalog, compression=args.compression,
+                                        prefilter=prefilter, timeout=timeout, limiter=limiter())
+        if args.stage in ("replace", "all") and catalog is not None:
+            try:
+                with metrics.stage("replace").timer():
+                    total_changes, changed_files = catalog.apply_rules(matcher)
+            except ValueError as e:
+                errors.append(str(e))
+            else:
+                print(f"{total_changes} values removed or changed in {changed_files} files")
+        elif args.stage in ("replace", "all"):
+            total_changes, replace_errors = pipeline.run_replace(
+                args.folder, matcher, backend="thread" if args.threads else "process", max_workers=args.jobs,
+                metrics=metrics)
+            errors += replace_errors
+            print(f"{total_changes} values removed")
+        if args.stage in ("write", "all"):
+            errors += pipeline.run_write(args.folder, pool, concurrency=args.concurrency,
+                                         batch_size=args.batch_size, order=args.order, resume=args.resume,
+                                         metrics=metrics, catalog=catalog, timeout=timeout, limiter=limiter(),
+                                         on_progress=lambda done, total: print(f"{done} of {total} files written"))
+        if args.stage == "fused":
+            total_changes, changed_files, fused_errors = run_fused(
+                args.folder, args.command, pool, matcher, read_workers=args.read_workers,
+                write_workers=args.write_workers, shard_size=args.shard_size, batch_size=args.batch_size,
+                queue_size=args.queue_size, metrics=metrics, prefilter=prefilter, timeout=timeout,
+                limiter=limiter())
+            errors += fused_errors
+            print(f"{total_changes} values removed from {changed_files} files")
+
+    if catalog is not None:
+        catalog.close()
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+    if args.prometheus:
+        metrics.write_prometheus(args.prometheus)
+    for error in errors:
+        print(error, file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
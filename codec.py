@@ -0,0 +1,148 @@
+"""JSON backend and file formats of the intermediate files.
+
+Every stage reads and writes JSON through loads() and dumps(), which use
+the fastest library installed: orjson, then ujson, then the standard
+library. REMOVE_TAG_JSON=json (or ujson, orjson) picks one by hand, e.g.
+to compare them.
+
+output.json and modified.json can be compressed, which pays off when the
+library sits on a network share: the files are read and written whole,
+and their size is what the share is slow at. The compression is part of
+the name, output.json.gz or output.json.zst; zstd needs the zstandard
+package. Readers take whichever variant a folder holds. exiftool never
+sees these files, so it is always given plain JSON.
+"""
+import os
+import re
+import gzip
+import json
+
+JSON_BACKEND_ENV = "REMOVE_TAG_JSON"
+
+# Compression of the intermediate files and the suffix it adds to the name
+SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+COMPRESSIONS = tuple(SUFFIXES)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _stdlib_backend():
+    return "json", json.loads, lambda obj: json.dumps(obj).encode("utf-8")
+
+
+def _orjson_backend():
+    import orjson
+    return "orjson", orjson.loads, orjson.dumps
+
+
+def _ujson_backend():
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode("utf-8")
+
+    return "ujson", ujson.loads, dumps
+
+
+_BACKENDS = {"orjson": _orjson_backend, "ujson": _ujson_backend, "json": _stdlib_backend}
+
+
+def _select_backend():
+    wanted = os.environ.get(JSON_BACKEND_ENV)
+    for name in ([wanted] if wanted in _BACKENDS else []) + list(_BACKENDS):
+        try:
+            return _BACKENDS[name]()
+        except ImportError:
+            continue
+
+
+BACKEND, _loads, _dumps = _select_backend()
+
+# A run of 19 digits may be an integer beyond 64 bits, which orjson turns
+# into a float and ujson refuses. A long number in a string matches too,
+# which only costs the slower parse.
+_LONG_NUMBER = re.compile(rb"[0-9]{19}")
+_LONG_NUMBER_TEXT = re.compile(r"[0-9]{19}")
+
+
+def loads(data):
+    # data is bytes or str. Documents with integers the fast backends can't
+    # hold go through the standard library.
+    if BACKEND != "json" and (_LONG_NUMBER_TEXT if isinstance(data, str) else _LONG_NUMBER).search(data):
+        return json.loads(data)
+    return _loads(data)
+
+
+def dumps(obj):
+    # Returns UTF-8 encoded bytes. Values the fast backends refuse, like
+    # integers beyond 64 bits, go through the standard library.
+    try:
+        return _dumps(obj)
+    except (TypeError, OverflowError):
+        return json.dumps(obj).encode("utf-8")
+
+
+def compression_of(path):
+    for compression, suffix in SUFFIXES.items():
+        if suffix and path.endswith(suffix):
+            return compression
+    return "none"
+
+
+def strip_suffix(file_name):
+    # The name of an intermediate file without its compression suffix
+    suffix = SUFFIXES[compression_of(file_name)]
+    return file_name[:len(file_name) - len(suffix)] if suffix else file_name
+
+
+def check_compression(compression):
+    if compression not in SUFFIXES:
+        raise ValueError(f"Unknown compression: {compression}")
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package")
+    return compression
+
+
+def open_file(path, mode, compression=None):
+    """Open an intermediate file in binary mode ("rb" or "wb").
+
+    compression defaults to the one named by the suffix of path.
+    """
+    compression = check_compression(compression or compression_of(path))
+    if compression == "gzip":
+        # Level 6 is most of the size gain of 9 at a fraction of the time
+        return gzip.open(path, mode, compresslevel=6)
+    if compression == "zstd":
+        return zstandard.open(path, mode)
+    return open(path, mode)
+
+
+def intermediate_paths(folder, name):
+    # Every variant of an intermediate file in folder, plain first
+    return [os.path.join(folder, name + suffix) for suffix in SUFFIXES.values()]
+
+
+def find_intermediate(folder, name):
+    """Return the path of the intermediate file name in folder, in any
+    compression, or None. If a folder holds several, the newest wins.
+    """
+    found = []
+    for path in intermediate_paths(folder, name):
+        try:
+            found.append((os.path.getmtime(path), path))
+        except OSError:
+            continue
+    return max(found)[1] if found else None
+
+
+def replace_intermediate(temp_path, path):
+    # Move a finished file into place and remove its variants in other
+    # compressions, which are now stale
+    os.replace(temp_path, path)
+    folder, file_name = os.path.split(path)
+    for other in intermediate_paths(folder, strip_suffix(file_name)):
+        if other != path and os.path.exists(other):
+            os.remove(other)
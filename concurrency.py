@@ -0,0 +1,149 @@
+"""Adaptive limit on the number of exiftool calls in flight.
+
+How many exiftool processes a library can keep busy depends on where it
+is stored: a local SSD takes one per CPU and more, while a NAS behind SMB
+can get slower with every reader past a handful. An AdaptiveLimiter finds
+the limit while the pipeline runs. Every worker holds a slot for the
+duration of one exiftool call:
+
+    limiter = AdaptiveLimiter(pool.size, bytes_per_sec=50 * 1024 * 1024)
+    with limiter.slot(len(files), num_bytes):
+        et.execute(...)
+
+After every round of calls (as many as the limit) the limiter compares the
+files per second of the round with the round before, and the time per
+file with the best seen so far. If throughput held up and latency didn't
+blow up, the limit goes up by one; otherwise it drops to three quarters
+(AIMD). The round after a drop is only judged by its latency, since
+fewer workers are expected to do less. Until the first drop the limit
+doubles instead, so a fast disk gets to its limit in a few rounds. The
+limit only grows in rounds where workers were actually waiting for a
+slot.
+
+bytes_per_sec caps the bytes handed to exiftool with a token bucket,
+e.g. to leave a shared NAS some room for other users.
+"""
+import time
+import threading
+import contextlib
+
+
+class TokenBucket:
+    """Lets through rate units per second on average, in bursts of up to
+    burst (default: one second's worth)."""
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("The rate must be positive")
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, amount):
+        # Blocks until the bucket isn't empty, then takes amount. A call
+        # larger than the bucket leaves it in debt, which later calls wait
+        # out, so any amount passes and the average rate still holds.
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens > 0:
+                    self.tokens -= amount
+                    return
+                time.sleep(-self.tokens / self.rate)
+
+
+class AdaptiveLimiter:
+    """AIMD limit between min_limit and max_limit on concurrent calls.
+
+    max_limit is usually the size of the exiftool pool. The limit starts
+    at initial (default: min_limit). With min_limit equal to max_limit the
+    limit is fixed, which is how a bytes/sec cap is used on its own.
+    """
+
+    def __init__(self, max_limit, min_limit=1, initial=None, bytes_per_sec=None, tolerance=0.05,
+                 latency_ratio=2.0, decrease=0.75):
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError("Need 1 <= min_limit <= max_limit")
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = max(min_limit, min(max_limit, initial or min_limit))
+        self.bucket = TokenBucket(bytes_per_sec) if bytes_per_sec else None
+        # A round with tolerance less throughput than the last one, or
+        # latency_ratio times the best time per file, counts as overload
+        self.tolerance = tolerance
+        self.latency_ratio = latency_ratio
+        self.decrease = decrease
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.slow_start = True
+        self.last_rate = None
+        self.best_latency = None
+        self._new_round(time.monotonic())
+
+    def _new_round(self, now):
+        self.round_start = now
+        self.round_calls = 0
+        self.round_files = 0
+        self.round_seconds = 0.0
+        self.saturated = False
+
+    @contextlib.contextmanager
+    def slot(self, files, num_bytes=0):
+        """Hold a slot for one call over files files of num_bytes bytes.
+
+        Blocks while the limit is reached, and then for the bytes/sec cap.
+        Calls that raise are not measured.
+        """
+        with self.condition:
+            self.waiting += 1
+            while self.in_flight >= self.limit:
+                self.saturated = True
+                self.condition.wait()
+            self.waiting -= 1
+            self.in_flight += 1
+        try:
+            if self.bucket is not None and num_bytes:
+                self.bucket.take(num_bytes)
+            start = time.monotonic()
+            yield
+            self._record(files, time.monotonic() - start)
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def _record(self, files, seconds):
+        with self.condition:
+            self.round_calls += 1
+            self.round_files += files
+            self.round_seconds += seconds
+            if self.waiting:
+                self.saturated = True
+            if self.round_calls >= self.limit:
+                self._adjust(time.monotonic())
+
+    def _adjust(self, now):
+        elapsed = now - self.round_start
+        if elapsed <= 0 or not self.round_files:
+            return
+        rate = self.round_files / elapsed
+        latency = self.round_seconds / self.round_files
+        if self.best_latency is None or latency < self.best_latency:
+            self.best_latency = latency
+        overloaded = ((self.last_rate is not None and rate < self.last_rate * (1 - self.tolerance))
+                      or latency > self.best_latency * self.latency_ratio)
+        if overloaded:
+            self.slow_start = False
+            self.limit = max(self.min_limit, int(self.limit * self.decrease))
+            self.last_rate = None
+        else:
+            if self.saturated:
+                self.limit = min(self.max_limit, self.limit * 2 if self.slow_start else self.limit + 1)
+            self.last_rate = rate
+        self._new_round(now)
+        self.condition.notify_all()
@@ -61,6 +61,12 @@ import os
 import json
 import warnings
 import codecs
+import contextlib
+import selectors
+import itertools
+import asyncio
+import queue
+import threading
 
 try:        # Py3k compatibility
     basestring
@@ -83,6 +89,10 @@ sentinel = b"{ready}"
 # some cases.
 block_size = 4096
 
+# Reads start at block_size and double whenever a read fills the whole
+# block, up to this size, so large responses need few system calls.
+max_block_size = 1 << 20
+
 # This code has been adapted from Lib/os.py in the Python source tree
 # (sha1 265e36e277f3)
 def _fscodec():
@@ -112,6 +122,141 @@ def _fscodec():
 fsencode = _fscodec()
 del _fscodec
 
+_whitespace = frozenset(b" \t\r\n\x0b\x0c")
+
+# Reading into a preallocated buffer avoids one copy per read where
+# the platform supports it.
+_readv = getattr(os, "readv", None)
+
+# select() on Windows only accepts sockets, so there a thread per pipe
+# reads the output of ``exiftool`` instead.
+_select_pipes = os.name != "nt"
+
+
+def _pump(fd, chunks):
+    # Put everything read from fd into chunks, ending with b"" at EOF
+    while True:
+        try:
+            chunk = os.read(fd, max_block_size)
+        except OSError:
+            chunk = b""
+        chunks.put((fd, chunk))
+        if not chunk:
+            return
+
+
+class ExifToolTimeout(Exception):
+    """Raised when ``exiftool`` stays silent for longer than the
+    ``timeout`` of a call.  The process has been killed by then."""
+
+
+class _OutputBuffer(object):
+    """Collect one output stream of ``exiftool`` up to the sentinel.
+
+    Data is read straight into a growable ``bytearray``, so the cost of
+    a response is linear in its size, and only newly read bytes are
+    searched for the sentinel.
+    """
+
+    def __init__(self):
+        self._data = bytearray(block_size)
+        self._length = 0
+        self._read_size = block_size
+        self._end = -1
+
+    def read_from(self, fd):
+        """Read once from ``fd`` and return whether the sentinel was seen.
+
+        ``IOError`` is raised if the stream ends before the sentinel.
+        """
+        start = self._length
+        size = self._read_size
+        if len(self._data) < start + size:
+            self._data.extend(bytes(max(len(self._data), start + size - len(self._data))))
+        if _readv is not None:
+            with memoryview(self._data) as view:
+                count = _readv(fd, [view[start:start + size]])
+        else:
+            chunk = os.read(fd, size)
+            count = len(chunk)
+            self._data[start:start + count] = chunk
+        return self._advance(start, count)
+
+    def feed(self, chunk):
+        """Add ``chunk``, read elsewhere, and return whether the
+        sentinel was seen."""
+        start = self._length
+        if len(self._data) < start + len(chunk):
+            self._data.extend(bytes(max(len(self._data), start + len(chunk) - len(self._data))))
+        self._data[start:start + len(chunk)] = chunk
+        return self._advance(start, len(chunk))
+
+    def _advance(self, start, count):
+        size = self._read_size
+        if not count:
+            raise IOError("exiftool exited unexpectedly")
+        self._length += count
+        if count == size and size < max_block_size:
+            self._read_size = size * 2
+        # A sentinel may be split over two reads, so look a little into
+        # the previously read data as well.
+        pos = self._data.rfind(sentinel, max(0, start - len(sentinel) + 1),
+                               self._length)
+        if pos != -1 and self._is_blank(pos + len(sentinel), self._length):
+            self._end = pos
+        return self._end != -1
+
+    def _is_blank(self, start, end):
+        return all(c in _whitespace for c in self._data[start:end])
+
+    def getvalue(self):
+        """Return the output up to the sentinel, without leading whitespace."""
+        start = 0
+        while start < self._end and self._data[start] in _whitespace:
+            start += 1
+        with memoryview(self._data) as view:
+            return view[start:self._end].tobytes()
+
+class _LineReader(object):
+    """Pass one output stream of ``exiftool`` to a callback line by line.
+
+    Only the last incomplete line is kept between reads, so memory use
+    doesn't grow with the size of the output.
+    """
+
+    def __init__(self, callback):
+        self._callback = callback
+        self._partial = b""
+        self._read_size = block_size
+
+    def read_from(self, fd):
+        """Read once from ``fd`` and return whether the sentinel was seen.
+
+        ``IOError`` is raised if the stream ends before the sentinel.
+        """
+        chunk = os.read(fd, self._read_size)
+        if len(chunk) == self._read_size and self._read_size < max_block_size:
+            self._read_size *= 2
+        return self.feed(chunk)
+
+    def feed(self, chunk):
+        """Pass on the lines completed by ``chunk``, read elsewhere, and
+        return whether the sentinel was seen."""
+        if not chunk:
+            raise IOError("exiftool exited unexpectedly")
+        lines = (self._partial + chunk).split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            line = line.rstrip(b"\r")
+            if line.endswith(sentinel):
+                line = line[:-len(sentinel)]
+                if line.strip():
+                    self._callback(line)
+                return True
+            self._callback(line)
+        return False
+
+
 class ExifTool(object):
     """Run the `exiftool` command-line tool and communicate to it.
 
@@ -146,32 +291,62 @@ class ExifTool(object):
 
        A Boolean value indicating whether this instance is currently
        associated with a running subprocess.
+
+    .. py:attribute:: last_stderr
+
+       The raw ``bytes`` written to stderr by ``exiftool`` during the
+       last call to :py:meth:`execute()`, with the sentinel removed.
+
+    :py:meth:`execute()` and :py:meth:`execute_lines()` take an optional
+    ``timeout``: the number of seconds ``exiftool`` may go without
+    writing anything to stdout or stderr.  With ``-progress``, or with
+    ``-j`` output, it prints something for every file, so this is the
+    time allowed per file, however long the batch.  When it runs out,
+    the process is killed and :py:class:`ExifToolTimeout` is raised.
+
+    The optional ``common_args`` argument replaces the default common
+    arguments ``-G`` and ``-n``; pass an empty list to run every
+    command exactly as given.
     """
 
-    def __init__(self, executable_=None):
+    def __init__(self, executable_=None, common_args=None):
         if executable_ is None:
             self.executable = executable
         else:
             self.executable = executable_
+        if common_args is None:
+            self.common_args = ["-G", "-n"]
+        else:
+            self.common_args = list(common_args)
         self.running = False
+        self.last_stderr = b""
 
     def start(self):
         """Start an ``exiftool`` process in batch mode for this instance.
 
         This method will issue a ``UserWarning`` if the subprocess is
-        already running.  The process is started with the ``-G`` and
+        already running.  Unless other ``common_args`` were given to
+        the constructor, the process is started with the ``-G`` and
         ``-n`` as common arguments, which are automatically included
         in every command you run with :py:meth:`execute()`.
         """
         if self.running:
             warnings.warn("ExifTool already running; doing nothing.")
             return
-        with open(os.devnull, "w") as devnull:
-            self._process = subprocess.Popen(
-                [self.executable, "-stay_open", "True",  "-@", "-",
-                 "-common_args", "-G", "-n"],
-                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                stderr=devnull)
+        args = [self.executable, "-stay_open", "True",  "-@", "-"]
+        if self.common_args:
+            args.append("-common_args")
+            args.extend(self.common_args)
+        self._process = subprocess.Popen(
+            args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        if not _select_pipes:
+            # The threads end when the process closes its pipes; exiftool
+            # is silent between commands, so no chunk spans two of them.
+            self._chunks = queue.Queue()
+            for stream in (self._process.stdout, self._process.stderr):
+                threading.Thread(target=_pump, args=(stream.fileno(), self._chunks),
+                                 daemon=True).start()
         self.running = True
 
     def terminate(self):
@@ -181,8 +356,26 @@ class ExifTool(object):
         """
         if not self.running:
             return
-        self._process.stdin.write(b"-stay_open\nFalse\n")
-        self._process.stdin.flush()
+        try:
+            self._process.stdin.write(b"-stay_open\nFalse\n")
+            self._process.stdin.flush()
+        except (IOError, OSError):
+            # The process already went away; just collect it below.
+            pass
+        self._process.communicate()
+        del self._process
+        self.running = False
+
+    def kill(self):
+        """Kill the ``exiftool`` process of this instance.
+
+        Unlike :py:meth:`terminate()` this does not wait for a command
+        in progress to finish.  It is used to discard a process whose
+        output stream is in an unknown state.
+        """
+        if not self.running:
+            return
+        self._process.kill()
         self._process.communicate()
         del self._process
         self.running = False
@@ -197,7 +390,7 @@ class ExifTool(object):
     def __del__(self):
         self.terminate()
 
-    def execute(self, *params):
+    def execute(self, *params, timeout=None):
         """Execute the given batch of parameters with ``exiftool``.
 
         This method accepts any number of parameters and sends them to
@@ -207,7 +400,8 @@ class ExifTool(object):
         automatically; see the documentation of :py:meth:`start()` for
         the common options.  The ``exiftool`` output is read up to the
         end-of-output sentinel and returned as a raw ``bytes`` object,
-        excluding the sentinel.
+        excluding the sentinel.  Whatever ``exiftool`` wrote to stderr
+        for this batch is stored in :py:attr:`last_stderr`.
 
         The parameters must also be raw ``bytes``, in whatever
         encoding exiftool accepts.  For filenames, this should be the
@@ -218,13 +412,82 @@ class ExifTool(object):
         """
         if not self.running:
             raise ValueError("ExifTool instance not running.")
-        self._process.stdin.write(b"\n".join(params + (b"-execute\n",)))
-        self._process.stdin.flush()
-        output = b""
-        fd = self._process.stdout.fileno()
-        while not output[-32:].strip().endswith(sentinel):
-            output += os.read(fd, block_size)
-        return output.strip()[:-len(sentinel)]
+        try:
+            # -echo4 prints the sentinel to stderr once the batch is
+            # done, so stderr can be read up to a known end as well.
+            self._process.stdin.write(b"\n".join(
+                params + (b"-echo4", sentinel, b"-execute\n")))
+            self._process.stdin.flush()
+            output, self.last_stderr = self._read_output(timeout)
+        except BaseException:
+            # Whatever is left in the pipes would be mistaken for the
+            # output of the next command, so the process can't be reused.
+            self.kill()
+            raise
+        return output
+
+    def execute_lines(self, on_stdout, on_stderr, *params, timeout=None):
+        """Execute the given batch of parameters, streaming the output.
+
+        This method is similar to :py:meth:`execute()`, but instead of
+        collecting the output it calls ``on_stdout`` and ``on_stderr``
+        with every line ``exiftool`` writes to stdout and stderr, as a
+        raw ``bytes`` object without the line ending, as soon as the
+        line arrives.  Memory use stays flat however verbose the
+        output is, which matters for long ``-v`` or ``-progress``
+        runs.  :py:attr:`last_stderr` is not set.
+        """
+        if not self.running:
+            raise ValueError("ExifTool instance not running.")
+        try:
+            self._process.stdin.write(b"\n".join(
+                params + (b"-echo4", sentinel, b"-execute\n")))
+            self._process.stdin.flush()
+            self._read_streams(_LineReader(on_stdout), _LineReader(on_stderr),
+                               timeout)
+        except BaseException:
+            self.kill()
+            raise
+
+    def _read_output(self, timeout=None):
+        stdout, stderr = _OutputBuffer(), _OutputBuffer()
+        self._read_streams(stdout, stderr, timeout)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def _read_streams(self, stdout_reader, stderr_reader, timeout=None):
+        # Feed both pipes to their readers until each has seen the
+        # sentinel; reading them together means neither can fill up and
+        # block exiftool. Any output restarts the timeout.
+        readers = {self._process.stdout.fileno(): stdout_reader,
+                   self._process.stderr.fileno(): stderr_reader}
+        if not _select_pipes:
+            self._read_chunks(readers, timeout)
+            return
+        with selectors.DefaultSelector() as selector:
+            for fd in readers:
+                selector.register(fd, selectors.EVENT_READ)
+            pending = len(readers)
+            while pending:
+                events = selector.select(timeout)
+                if not events:
+                    raise ExifToolTimeout(
+                        "exiftool wrote nothing for {} seconds".format(timeout))
+                for key, _ in events:
+                    if readers[key.fd].read_from(key.fd):
+                        selector.unregister(key.fd)
+                        pending -= 1
+
+    def _read_chunks(self, readers, timeout):
+        # _read_streams() on top of the reader threads started by start()
+        pending = set(readers)
+        while pending:
+            try:
+                fd, chunk = self._chunks.get(timeout=timeout)
+            except queue.Empty:
+                raise ExifToolTimeout(
+                    "exiftool wrote nothing for {} seconds".format(timeout))
+            if readers[fd].feed(chunk):
+                pending.discard(fd)
 
     def execute_json(self, *params):
         """Execute the given batch of parameters and parse the JSON output.
@@ -278,17 +541,7 @@ class ExifTool(object):
         The format of the return value is the same as for
         :py:meth:`execute_json()`.
         """
-        # Explicitly ruling out strings here because passing in a
-        # string would lead to strange and hard-to-find errors
-        if isinstance(tags, basestring):
-            raise TypeError("The argument 'tags' must be "
-                            "an iterable of strings")
-        if isinstance(filenames, basestring):
-            raise TypeError("The argument 'filenames' must be "
-                            "an iterable of strings")
-        params = ["-" + t for t in tags]
-        params.extend(filenames)
-        return self.execute_json(*params)
+        return self.execute_json(*_tags_params(tags, filenames))
 
     def get_tags(self, tags, filename):
         """Return only specified tags for a single file.
@@ -309,12 +562,7 @@ class ExifTool(object):
         The return value is a list of tag values or ``None`` for
         non-existent tags, in the same order as ``filenames``.
         """
-        data = self.get_tags_batch([tag], filenames)
-        result = []
-        for d in data:
-            d.pop("SourceFile")
-            result.append(next(iter(d.values()), None))
-        return result
+        return _tag_values(self.get_tags_batch([tag], filenames))
 
     def get_tag(self, tag, filename):
         """Extract a single tag from a single file.
@@ -323,3 +571,332 @@ class ExifTool(object):
         ``None`` if this tag was not found in the file.
         """
         return self.get_tag_batch(tag, [filename])[0]
+
+
+def _tags_params(tags, filenames):
+    # Explicitly ruling out strings here because passing in a
+    # string would lead to strange and hard-to-find errors
+    if isinstance(tags, basestring):
+        raise TypeError("The argument 'tags' must be "
+                        "an iterable of strings")
+    if isinstance(filenames, basestring):
+        raise TypeError("The argument 'filenames' must be "
+                        "an iterable of strings")
+    params = ["-" + t for t in tags]
+    params.extend(filenames)
+    return params
+
+
+def _tag_values(data):
+    result = []
+    for d in data:
+        d.pop("SourceFile")
+        result.append(next(iter(d.values()), None))
+    return result
+
+
+class ExifToolPool(object):
+    """Keep a number of long-lived :py:class:`ExifTool` instances and
+    hand them out to worker threads.
+
+    Starting ``exiftool`` means starting Perl and loading its modules,
+    which for small batches costs more than the metadata work itself.
+    A pool lets every stage of a run share a few processes that stay
+    open for the whole run::
+
+        with ExifToolPool() as pool:
+            with pool.acquire() as et:
+                output = et.execute(b"-j", b"a.jpg")
+
+    ``size`` defaults to the number of CPUs.  The remaining arguments
+    are passed on to every :py:class:`ExifTool` instance.  Processes
+    are started lazily the first time an instance is checked out, and
+    an instance whose process died or was killed is restarted on its
+    next checkout.  :py:meth:`acquire()` blocks while all instances
+    are in use.
+    """
+
+    def __init__(self, size=None, executable_=None, common_args=None):
+        if size is None:
+            size = os.cpu_count() or 1
+        if size < 1:
+            raise ValueError("ExifToolPool size must be at least 1")
+        self.size = size
+        self._instances = [ExifTool(executable_, common_args)
+                           for _ in range(size)]
+        # LIFO, so that already running instances are reused before
+        # idle ones get started.
+        self._idle = queue.LifoQueue()
+        for et in self._instances:
+            self._idle.put(et)
+
+    @contextlib.contextmanager
+    def acquire(self):
+        """Check out a running :py:class:`ExifTool` instance.
+
+        Use as a context manager; the instance is returned to the pool
+        when the ``with`` block exits.
+        """
+        et = self._idle.get()
+        try:
+            if not et.running:
+                et.start()
+            yield et
+        finally:
+            self._idle.put(et)
+
+    def terminate(self):
+        """Terminate all ``exiftool`` processes of this pool.
+
+        Instances that are checked out at this point are terminated as
+        well, so this should only be called once all workers are done.
+        """
+        for et in self._instances:
+            et.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.terminate()
+
+
+async def _read_until(stream, marker):
+    """Read ``stream`` up to ``marker`` and return what came before it,
+    without leading whitespace.
+
+    ``IOError`` is raised if the stream ends before the marker.
+    """
+    data = bytearray()
+    while True:
+        chunk = await stream.read(max_block_size)
+        if not chunk:
+            raise IOError("exiftool exited unexpectedly")
+        # The marker may be split over two reads
+        start = max(0, len(data) - len(marker) + 1)
+        data += chunk
+        pos = data.find(marker, start)
+        if pos != -1:
+            return bytes(data[:pos]).lstrip()
+
+
+class AsyncExifTool(object):
+    """Run ``exiftool`` in batch mode from an :py:mod:`asyncio` event loop.
+
+    This is the asynchronous counterpart of :py:class:`ExifTool`, with
+    the same methods as coroutines.  The pipes are read by the event
+    loop, so one thread can drive many processes.  Every command is
+    ended with its own ``-execute<NUM>``, and its output is read up to
+    the matching ``{ready<NUM>}``, so the output of one command can't
+    be taken for that of another.
+
+    Each method takes an optional ``timeout`` in seconds.  When a call
+    times out (``asyncio.TimeoutError``) or the task running it is
+    cancelled, the process is killed, since its pipes are then in an
+    unknown state; :py:attr:`running` turns false and the instance can
+    be started again.  Commands sent to one instance run one at a time,
+    in the order they were awaited.
+
+    ::
+
+        async with AsyncExifTool() as et:
+            metadata = await et.get_metadata_batch(files, timeout=60)
+    """
+
+    def __init__(self, executable_=None, common_args=None):
+        if executable_ is None:
+            self.executable = executable
+        else:
+            self.executable = executable_
+        if common_args is None:
+            self.common_args = ["-G", "-n"]
+        else:
+            self.common_args = list(common_args)
+        self.running = False
+        self.last_stderr = b""
+        self._sequence = itertools.count(1)
+        self._lock = None
+
+    async def start(self):
+        """Start the ``exiftool`` process of this instance."""
+        if self.running:
+            warnings.warn("ExifTool already running; doing nothing.")
+            return
+        args = ["-stay_open", "True", "-@", "-"]
+        if self.common_args:
+            args.append("-common_args")
+            args.extend(self.common_args)
+        self._process = await asyncio.create_subprocess_exec(
+            self.executable, *args, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._lock = asyncio.Lock()
+        self.running = True
+
+    async def terminate(self):
+        """Terminate the ``exiftool`` process once it is idle."""
+        if not self.running:
+            return
+        async with self._lock:
+            if not self.running:
+                return
+            try:
+                self._process.stdin.write(b"-stay_open\nFalse\n")
+                await self._process.stdin.drain()
+            except (IOError, OSError):
+                pass
+            await self._process.communicate()
+            self.running = False
+
+    async def kill(self):
+        """Kill the ``exiftool`` process without waiting for the
+        command in progress."""
+        if not self.running:
+            return
+        self.running = False
+        try:
+            self._process.kill()
+        except ProcessLookupError:
+            pass
+        # Collect the process even if the caller is being cancelled
+        await asyncio.shield(self._process.wait())
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.terminate()
+
+    async def execute(self, *params, timeout=None):
+        """Execute the given batch of raw ``bytes`` parameters and return
+        the output, as :py:meth:`ExifTool.execute()` does.
+
+        ``timeout`` limits the time the command may take, including the
+        wait for an earlier command to the same process.
+        """
+        if not self.running:
+            raise ValueError("ExifTool instance not running.")
+        return await asyncio.wait_for(self._execute(params), timeout)
+
+    async def _execute(self, params):
+        async with self._lock:
+            if not self.running:
+                raise ValueError("ExifTool instance not running.")
+            number = next(self._sequence)
+            ready = b"{ready%d}" % number
+            try:
+                self._process.stdin.write(b"\n".join(
+                    params + (b"-echo4", ready, b"-execute%d\n" % number)))
+                await self._process.stdin.drain()
+                output, self.last_stderr = await asyncio.gather(
+                    _read_until(self._process.stdout, ready),
+                    _read_until(self._process.stderr, ready))
+            except BaseException:
+                await self.kill()
+                raise
+        return output
+
+    async def execute_json(self, *params, timeout=None):
+        """Execute the given parameters with ``-j`` and parse the JSON
+        output, as :py:meth:`ExifTool.execute_json()` does."""
+        params = tuple(map(fsencode, params))
+        output = await self.execute(b"-j", *params, timeout=timeout)
+        return json.loads(output.decode("utf-8"))
+
+    async def get_metadata_batch(self, filenames, timeout=None):
+        return await self.execute_json(*filenames, timeout=timeout)
+
+    async def get_metadata(self, filename, timeout=None):
+        return (await self.execute_json(filename, timeout=timeout))[0]
+
+    async def get_tags_batch(self, tags, filenames, timeout=None):
+        return await self.execute_json(*_tags_params(tags, filenames),
+                                       timeout=timeout)
+
+    async def get_tags(self, tags, filename, timeout=None):
+        return (await self.get_tags_batch(tags, [filename], timeout))[0]
+
+    async def get_tag_batch(self, tag, filenames, timeout=None):
+        return _tag_values(await self.get_tags_batch([tag], filenames,
+                                                     timeout))
+
+    async def get_tag(self, tag, filename, timeout=None):
+        return (await self.get_tag_batch(tag, [filename], timeout))[0]
+
+
+class AsyncExifToolPool(object):
+    """A pool of :py:class:`AsyncExifTool` instances for one event loop.
+
+    The asynchronous counterpart of :py:class:`ExifToolPool`: up to
+    ``size`` commands run at the same time, one per process, and
+    further callers wait for a free instance.  An instance killed by a
+    timeout or a cancellation is restarted on its next checkout::
+
+        async with AsyncExifToolPool(16) as pool:
+            results = await asyncio.gather(*(
+                pool.get_tags_batch(tags, shard, timeout=120)
+                for shard in shards))
+
+    The ``execute`` and ``get_*`` methods check out an instance for
+    one call; :py:meth:`acquire()` keeps one for several.
+    """
+
+    def __init__(self, size=None, executable_=None, common_args=None):
+        if size is None:
+            size = os.cpu_count() or 1
+        if size < 1:
+            raise ValueError("ExifToolPool size must be at least 1")
+        self.size = size
+        self._instances = [AsyncExifTool(executable_, common_args)
+                           for _ in range(size)]
+        self._idle = None
+
+    def _idle_queue(self):
+        # Created on first use, inside the event loop
+        if self._idle is None:
+            self._idle = asyncio.LifoQueue()
+            for et in self._instances:
+                self._idle.put_nowait(et)
+        return self._idle
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        """Check out a running :py:class:`AsyncExifTool` instance."""
+        idle = self._idle_queue()
+        et = await idle.get()
+        try:
+            if not et.running:
+                await et.start()
+            yield et
+        finally:
+            idle.put_nowait(et)
+
+    async def execute(self, *params, timeout=None):
+        async with self.acquire() as et:
+            return await et.execute(*params, timeout=timeout)
+
+    async def execute_json(self, *params, timeout=None):
+        async with self.acquire() as et:
+            return await et.execute_json(*params, timeout=timeout)
+
+    async def get_metadata_batch(self, filenames, timeout=None):
+        async with self.acquire() as et:
+            return await et.get_metadata_batch(filenames, timeout)
+
+    async def get_tags_batch(self, tags, filenames, timeout=None):
+        async with self.acquire() as et:
+            return await et.get_tags_batch(tags, filenames, timeout)
+
+    async def get_tag_batch(self, tag, filenames, timeout=None):
+        async with self.acquire() as et:
+            return await et.get_tag_batch(tag, filenames, timeout)
+
+    async def terminate(self):
+        """Terminate all ``exiftool`` processes of this pool."""
+        await asyncio.gather(*(et.terminate() for et in self._instances))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.terminate()
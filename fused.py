@@ -0,0 +1,198 @@
+"""Fused scan, replace and write in a single pass.
+
+Records stream from exiftool readers through the replace filter into
+exiftool writers over bounded queues, so all three stages overlap and no
+output.json or modified.json is written or parsed. Only files that need
+changes reach the writers. The manifest cache is not used here: every
+file is read, since a cached record is only useful together with the
+output.json the staged workflow keeps.
+
+Like the staged write, a fused run only touches the year folders
+(top-level folders named with digits); other top-level folders are
+neither read nor written.
+"""
+import os
+import time
+import queue
+import threading
+from manifest import list_files
+from metrics import RunMetrics, profile_call
+from rules import as_ruleset, UngroupedTagError
+from quarantine import Quarantine
+from pipeline import WriteBatch, OutputLogs, list_year_folders, command_params, scan_shard, process_record, \
+    write_metadata_to_image, file_size, quarantined_split, DEFAULT_TIMEOUT
+
+_DONE = object()
+
+
+def run_fused(folder_path, command, pool, matcher, read_workers=None, write_workers=None, shard_size=500,
+              batch_size=500, queue_size=10000, on_progress=None, metrics=None, prefilter=None,
+              timeout=DEFAULT_TIMEOUT, limiter=None):
+    """Scan, filter and write every year folder of folder_path.
+
+    read_workers and write_workers default to half the pool each. At most
+    queue_size records wait between the readers and the filter, and a few
+    batches per writer wait between the filter and the writers, so memory
+    stays bounded however large the library is. on_progress is called
+    with the number of files read so far and the total. With a
+    prefilter.Prefilter, the readers only send the files it can't rule out
+    to exiftool. Shards and batches that exiftool hangs on for timeout
+    seconds are bisected as in the staged workflow, and the files that
+    hang go to the quarantine list of folder_path, whose files are skipped.
+    A concurrency.AdaptiveLimiter sets how many readers run exiftool at a
+    time; the few writers only see the files that changed.
+    Returns the number of removed values, the number of changed files and
+    the error messages.
+    """
+    folder_path = os.path.abspath(folder_path)
+    stage = (metrics or RunMetrics()).stage("fused")
+    with stage.timer():
+        return _run_fused(folder_path, command, pool, matcher, read_workers, write_workers, shard_size, batch_size,
+                          queue_size, on_progress, stage, prefilter, timeout, limiter)
+
+
+def _run_fused(folder_path, command, pool, matcher, read_workers, write_workers, shard_size, batch_size,
+               queue_size, on_progress, stage, prefilter, timeout, limiter):
+    params = command_params(command)
+    matcher = as_ruleset(matcher)
+    read_workers = read_workers or max(1, pool.size // 2)
+    write_workers = write_workers or max(1, pool.size - read_workers)
+
+    errors = []
+    errors_lock = threading.Lock()
+
+    def add_error(error):
+        with errors_lock:
+            errors.append(error)
+
+    quarantine = Quarantine.for_folder(folder_path)
+    quarantined = quarantine.paths()
+
+    def quarantine_file(folder, stage_name):
+        def timed_out(path):
+            stage.add(folder, quarantined=1)
+            quarantine.add(path, stage_name)
+        return timed_out
+
+    shards = queue.Queue()
+    num_files = 0
+    for folder in list_year_folders(folder_path):
+        files, skipped = quarantined_split(list_files(folder, params), quarantined)
+        stage.add(folder, skipped=len(skipped))
+        num_files += len(files)
+        for start in range(0, len(files), shard_size):
+            shards.put((folder, files[start:start + shard_size]))
+
+    records = queue.Queue(maxsize=queue_size)
+    batches = queue.Queue(maxsize=2 * write_workers)
+    files_read = [0]
+    output_logs = OutputLogs()
+    totals = {"removed": 0, "changed": 0}
+
+    def reader():
+        while True:
+            stage.queue_depth("shards", shards.qsize())
+            try:
+                folder, shard = shards.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            candidates, skipped = shard, []
+            try:
+                if prefilter is not None:
+                    with stage.measure("prefilter"):
+                        candidates, skipped = prefilter.split(shard)
+                shard_records, shard_errors = (scan_shard(candidates, params, pool, stage, timeout,
+                                                          quarantine_file(folder, "scan"), limiter)
+                                               if candidates else ({}, []))
+            except Exception as e:
+                add_error(f"Error processing folder: {folder}\n{str(e)}")
+            else:
+                stage.add(folder, processed=len(shard), skipped=len(skipped),
+                          bytes_read=sum(file_size(path) for path in candidates),
+                          busy_seconds=time.perf_counter() - start)
+                if shard_errors:
+                    add_error(f"Error processing folder: {folder}\n" + "\n".join(shard_errors))
+                for record in shard_records.values():
+                    records.put((folder, record))
+                stage.queue_depth("records", records.qsize())
+            # A failed shard counts as read too, so progress still ends at
+            # the total
+            with errors_lock:
+                files_read[0] += len(shard)
+                if on_progress:
+                    on_progress(files_read[0], num_files)
+
+    def replace_filter():
+        # Collects the changed records per folder into write batches
+        pending = {}
+        ungrouped = False
+        while True:
+            item = records.get()
+            if item is _DONE:
+                break
+            folder, record = item
+            if ungrouped:
+                # The readers are still drained, so they don't block
+                continue
+            try:
+                count, change = process_record(record, matcher)
+            except UngroupedTagError as e:
+                # Every record of the scan command is the same, so the
+                # rules can't run on any of them
+                add_error(str(e))
+                ungrouped = True
+                continue
+            except Exception as e:
+                add_error(f"Error processing file: {record.get('SourceFile')}\n{str(e)}")
+                continue
+            if change is None:
+                stage.add(folder, skipped=1)
+                continue
+            stage.add(folder, changed=1)
+            totals["removed"] += count
+            totals["changed"] += 1
+            folder_records = pending.setdefault(folder, [])
+            folder_records.append(change)
+            if len(folder_records) >= batch_size:
+                batches.put(WriteBatch(folder, folder, pending.pop(folder), 0))
+                stage.queue_depth("batches", batches.qsize())
+        for folder, folder_records in pending.items():
+            batches.put(WriteBatch(folder, folder, folder_records, 0))
+        for _ in range(write_workers):
+            batches.put(_DONE)
+
+    def writer():
+        while True:
+            batch = batches.get()
+            if batch is _DONE:
+                return
+            start = time.perf_counter()
+            try:
+                for error in write_metadata_to_image(batch.directory, batch.records, pool, batch.log_directory,
+                                                     stage, output_logs=output_logs, timeout=timeout,
+                                                     on_timeout=quarantine_file(batch.directory, "write")):
+                    add_error(error)
+            except Exception as e:
+                add_error(f"Error writing metadata: {batch.directory}\n{str(e)}")
+            stage.add(batch.directory,
+                      bytes_written=sum(file_size(record["SourceFile"]) for record in batch.records),
+                      busy_seconds=time.perf_counter() - start)
+
+    # Every thread is profiled on its own when the run has a profile_dir
+    def profiled_thread(target):
+        return threading.Thread(target=profile_call, args=(stage.run.profile_dir, "fused", target))
+
+    readers = [profiled_thread(reader) for _ in range(read_workers)]
+    writers = [profiled_thread(writer) for _ in range(write_workers)]
+    filter_thread = profiled_thread(replace_filter)
+    for thread in readers + writers + [filter_thread]:
+        thread.start()
+    for thread in readers:
+        thread.join()
+    records.put(_DONE)
+    filter_thread.join()
+    for thread in writers:
+        thread.join()
+    output_logs.close()
+    return totals["removed"], totals["changed"], errors
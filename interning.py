@@ -0,0 +1,38 @@
+"""One shared copy of each repeated tag value.
+
+The same keywords and person names appear in thousands of records, but
+the JSON parser makes a new string object for every occurrence. An
+Interner keeps one copy of each distinct string, and compact() rebuilds a
+record around those copies. Records held in memory for a whole folder or
+a whole write plan then share their strings, and a lookup of an interned
+value in a dict keyed by the same copy is settled by identity.
+
+Unlike sys.intern() the copies live only as long as the Interner, so a
+stage drops them all when it is done.
+"""
+
+
+class Interner:
+
+    def __init__(self):
+        self.strings = {}
+
+    def __call__(self, value):
+        return self.strings.setdefault(value, value)
+
+    def compact(self, record):
+        # A copy of record with its tag names and string values, including
+        # the items of lists, replaced by the shared copies
+        strings = self.strings
+        compact = {}
+        for tag, value in record.items():
+            if tag == "SourceFile":
+                # Unique to the record, nothing to share
+                compact[tag] = value
+                continue
+            if value.__class__ is str:
+                value = strings.setdefault(value, value)
+            elif value.__class__ is list:
+                value = [strings.setdefault(item, item) if item.__class__ is str else item for item in value]
+            compact[strings.setdefault(tag, tag)] = value
+        return compact
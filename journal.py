@@ -0,0 +1,72 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+JOURNAL_NAME = ".write_journal.jsonl"
+
+
+def update_digest(record):
+    # Identifies one pending update, so a changed modified.json is not
+    # mistaken for work that was already done
+    return hashlib.sha1(json.dumps(record, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+class WriteJournal:
+    """Append-only journal of completed write batches.
+
+    Every finished batch appends one line with the digest of each file's
+    update and is synced to disk before the next batch is recorded. Lines
+    are written with a single append under a lock, so concurrent writers
+    never interleave, and a line cut short by a crash is ignored when the
+    journal is read back.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fd = None
+
+    @classmethod
+    def for_folder(cls, folder_path):
+        return cls(os.path.join(folder_path, JOURNAL_NAME))
+
+    def completed(self):
+        # path -> digest of the update that was written
+        done = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        done.update(json.loads(line)["files"])
+                    except (ValueError, KeyError):
+                        continue
+        except OSError:
+            pass
+        return done
+
+    def open(self, resume):
+        # A fresh run starts a new journal; a resumed one appends to it
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if not resume:
+            flags |= os.O_TRUNC
+        self.fd = os.open(self.path, flags, 0o644)
+
+    def record_batch(self, records):
+        line = json.dumps({"time": time.time(),
+                           "files": {record["SourceFile"]: update_digest(record) for record in records}})
+        with self.lock:
+            os.write(self.fd, (line + "\n").encode('utf-8'))
+            os.fsync(self.fd)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,154 @@
+import io
+import json
+import codec
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+class _ArrayReader:
+    def __init__(self, fp, chunk_size):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size):
+        # Drop what has been consumed so the buffer only ever holds about
+        # one record plus one chunk
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        data = self.fp.read(size)
+        if not data:
+            self.eof = True
+        self.buffer += data
+
+    def next_char(self):
+        # Skip whitespace and return the next character, '' at end of file
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return ''
+            self.fill(self.chunk_size)
+
+    def decode_value(self):
+        self.next_char()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            # The record is larger than what is buffered; read more, in
+            # growing steps so a huge record isn't re-parsed too often
+            self.fill(size)
+            size *= 2
+
+
+def iter_json_array(fp, chunk_size=1 << 16):
+    """Yield the items of the top-level JSON array in a text file one by one.
+
+    Only the current item and one read chunk are held in memory. An empty
+    file yields nothing.
+    """
+    reader = _ArrayReader(fp, chunk_size)
+    char = reader.next_char()
+    if char == '':
+        return
+    if char != '[':
+        raise ValueError(f"Expected a JSON array, found {char!r}")
+    reader.pos += 1
+    if reader.next_char() == ']':
+        return
+    while True:
+        yield reader.decode_value()
+        char = reader.next_char()
+        reader.pos += 1
+        if char == ']':
+            return
+        if char != ',':
+            raise ValueError(f"Expected ',' or ']' in JSON array, found {char!r}")
+
+
+def iter_json_file(path):
+    """Yield the items of the JSON array in an intermediate file, which may
+    be compressed.
+
+    Files written by JsonArrayWriter hold one item per line, and each line
+    is parsed on its own by the fast JSON backend. Any other layout is
+    read with iter_json_array(), which is slower but takes any JSON.
+    """
+    with codec.open_file(path, "rb") as f:
+        first = f.readline().strip()
+        if first == b"[]":
+            return
+        try:
+            item = _array_line_item(first, first=True)
+        except ValueError:
+            item = None
+        if item is not None:
+            yield item
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield _array_line_item(line)
+            return
+    # Not one item per line; nothing has been yielded yet, so start over
+    # with the streaming parser
+    with codec.open_file(path, "rb") as f:
+        yield from iter_json_array(io.TextIOWrapper(f, encoding="utf-8"))
+
+
+def _array_line_item(line, first=False):
+    # The item on one line of JsonArrayWriter output: "[item," first,
+    # "item," after it and "item]" last
+    if first:
+        if not line.startswith(b"["):
+            return None
+        line = line[1:]
+    if line.endswith(b","):
+        line = line[:-1]
+    elif line.endswith(b"]"):
+        line = line[:-1]
+    item = codec.loads(line)
+    if not isinstance(item, dict):
+        if first:
+            return None
+        raise ValueError("Expected one record per line")
+    return item
+
+
+class JsonArrayWriter:
+    """Write items to a binary file as one JSON array, one item per line."""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.count = 0
+        self.fp.write(b'[')
+
+    def write(self, item):
+        if self.count:
+            self.fp.write(b',\n')
+        self.fp.write(codec.dumps(item))
+        self.count += 1
+
+    def close(self):
+        self.fp.write(b']\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
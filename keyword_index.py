@@ -0,0 +1,165 @@
+"""Inverted index from tag values to the files that carry them.
+
+The scan stage saves one index per scanned folder next to its manifest.
+KeywordIndex.load() merges the indexes of a library, and preview() shows
+what a set of replace and keep patterns would do. The rules run once per
+distinct value, not once per file, so a preview takes milliseconds where
+a dry run over every output.json takes minutes:
+
+    index = KeywordIndex.load("/photos")
+    print(format_preview(index.preview(TagMatcher(["Face_"], ["Family"]))))
+"""
+import os
+import codec
+from collections import namedtuple
+from matcher import TagMatcher
+from rules import as_ruleset, DROP
+from interning import Interner
+
+INDEX_NAME = ".keyword_index.json"
+INDEX_VERSION = 1
+
+# values: distinct values affected, files: files affected, top: the values
+# with the most files as (value, number of files, an example file)
+PatternPreview = namedtuple("PatternPreview", ["pattern", "values", "files", "top"])
+# total: everything the matcher would change. patterns: what each replace
+# pattern would remove on its own. keep: what each keep pattern protects.
+Preview = namedtuple("Preview", ["total", "patterns", "keep"])
+
+
+def build_folder_index(records):
+    # The index of one folder as saved to INDEX_NAME: the files, and for
+    # list and scalar tags the ids of the files holding each string value
+    files = []
+    tables = {"lists": {}, "scalars": {}}
+    for file_id, record in enumerate(records):
+        files.append(record["SourceFile"])
+        for tag, value in record.items():
+            if tag == "SourceFile":
+                continue
+            if isinstance(value, list):
+                values = tables["lists"].setdefault(tag, {})
+                for item in set(item for item in value if isinstance(item, str)):
+                    values.setdefault(item, []).append(file_id)
+            elif isinstance(value, str):
+                tables["scalars"].setdefault(tag, {}).setdefault(value, []).append(file_id)
+    return {"version": INDEX_VERSION, "files": files, **tables}
+
+
+def save_folder_index(folder, records):
+    path = os.path.join(folder, INDEX_NAME)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(codec.dumps(build_folder_index(records)))
+    os.replace(temp_path, path)
+
+
+class KeywordIndex:
+    """The merged keyword indexes of a library, as of its last scan."""
+
+    def __init__(self):
+        self.files = []
+        # {tag: {value: [file ids]}} for values in lists and scalar values
+        self.lists = {}
+        self.scalars = {}
+        # Each folder's index has its own copy of a value
+        self.intern = Interner()
+
+    @classmethod
+    def load(cls, folder_path):
+        # Merges the indexes of the scanned top-level folders of
+        # folder_path; folders scanned before indexes existed are skipped
+        index = cls()
+        for name in sorted(os.listdir(folder_path)):
+            try:
+                with open(os.path.join(folder_path, name, INDEX_NAME), "rb") as f:
+                    index.add(codec.loads(f.read()))
+            except (OSError, ValueError):
+                continue
+        return index
+
+    def add(self, folder_index):
+        if folder_index.get("version") != INDEX_VERSION:
+            return
+        offset = len(self.files)
+        self.files.extend(folder_index["files"])
+        for table, merged in ((folder_index["lists"], self.lists), (folder_index["scalars"], self.scalars)):
+            for tag, values in table.items():
+                merged_values = merged.setdefault(self.intern(tag), {})
+                for value, file_ids in values.items():
+                    merged_values.setdefault(self.intern(value), []).extend(file_id + offset for file_id in file_ids)
+
+    def matches(self, matcher):
+        """Yield (value, file ids) for every tag value matcher would drop or
+        change. matcher is a RuleSet or a TagMatcher.
+        """
+        ruleset = as_ruleset(matcher)
+        for table, is_list in ((self.lists, True), (self.scalars, False)):
+            for tag, values in table.items():
+                plan = ruleset.plan_for(tag)
+                rules, chain = (plan.list_rules, plan.list_chain) if is_list else (plan.scalar_rules, plan.scalar_chain)
+                if not rules:
+                    continue
+                for value, file_ids in values.items():
+                    new_value = chain(value)
+                    if new_value is DROP or new_value != value:
+                        yield value, file_ids
+
+    def summarize(self, pattern, matches, top=5):
+        files = set()
+        by_value = {}
+        for value, file_ids in matches:
+            files.update(file_ids)
+            by_value.setdefault(value, set()).update(file_ids)
+        ranked = sorted(by_value.items(), key=lambda item: (-len(item[1]), item[0]))[:top]
+        return PatternPreview(pattern, len(by_value), len(files),
+                              [(value, len(file_ids), self.files[min(file_ids)]) for value, file_ids in ranked])
+
+    def preview(self, matcher, top=5):
+        """Return a Preview of what matcher would change.
+
+        For a TagMatcher the preview is also broken down by pattern: each
+        replace pattern on its own, together with the keep patterns, and
+        each keep pattern with the values it saves from the replace list.
+        The breakdown takes one more pass over the values, in which each
+        value any replace pattern finds is told which patterns it holds,
+        so it stays fast with hundreds of patterns. Raises ValueError for
+        an invalid pattern.
+        """
+        total = self.summarize("all patterns", self.matches(matcher), top)
+        patterns, keep = [], []
+        if isinstance(matcher, TagMatcher):
+            options = {"case_insensitive": matcher.case_insensitive, "whole_word": matcher.whole_word,
+                       "regex": matcher.regex}
+            unprotected = TagMatcher(matcher.replace_list, [], **options)
+            protector = TagMatcher(matcher.not_replace_list, [], **options)
+            removed = [[] for _ in matcher.replace_list]
+            kept = [[] for _ in matcher.not_replace_list]
+            for value, file_ids in self.matches(unprotected):
+                protected_by = protector.find_patterns(value) if kept else []
+                for index in protected_by:
+                    kept[index].append((value, file_ids))
+                if not protected_by:
+                    for index in unprotected.find_patterns(value):
+                        removed[index].append((value, file_ids))
+            patterns = [self.summarize(pattern, matches, top)
+                        for pattern, matches in zip(matcher.replace_list, removed)]
+            keep = [self.summarize(pattern, matches, top)
+                    for pattern, matches in zip(matcher.not_replace_list, kept)]
+        return Preview(total, patterns, keep)
+
+
+def format_preview(preview):
+    # Plain text for the CLI and the GUI preview panel
+    def section(summary, verb):
+        lines = [f"{summary.pattern}: {verb} {summary.values} values in {summary.files} files"]
+        for value, num_files, example in summary.top:
+            lines.append(f"    {value!r}: {num_files} files, e.g. {example}")
+        return lines
+
+    lines = section(preview.total, "changes")
+    for summary in preview.patterns:
+        lines += [""] + section(summary, "removes")
+    for summary in preview.keep:
+        lines += [""] + section(summary, "keeps")
+    return "\n".join(lines)
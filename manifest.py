@@ -0,0 +1,118 @@
+import os
+import re
+import codec
+from keyword_index import INDEX_NAME
+from interning import Interner
+from quarantine import QUARANTINE_NAME
+
+MANIFEST_NAME = ".exif_manifest.json"
+MANIFEST_VERSION = 1
+
+# Files written by the pipeline itself, never sent to exiftool
+PIPELINE_FILES = {"errors.txt", "exiftool_output.txt", MANIFEST_NAME, INDEX_NAME, QUARANTINE_NAME,
+                  *codec.intermediate_paths("", "output.json"), *codec.intermediate_paths("", "modified.json")}
+# Rotated copies of exiftool_output.txt
+ROTATED_LOG = re.compile(r"exiftool_output\.\d+\.txt$")
+
+
+def extension_filters(params):
+    # The -ext/--ext options of the exiftool command as (include, exclude)
+    # sets of lower-case extensions without the dot
+    include, exclude = set(), set()
+    for option, value in zip(params, params[1:]):
+        option = option.lower()
+        extension = value.lstrip('.').lower()
+        if option in ("--ext", "--extension"):
+            exclude.add(extension)
+        elif option in ("-ext", "-ext+", "-extension", "-extension+"):
+            include.add(extension)
+    return include, exclude
+
+
+def list_files(folder, params):
+    # Files exiftool would visit for "<folder>" (recursively with -r): hidden
+    # files and directories are skipped, as are the -ext/--ext filtered
+    # extensions
+    include, exclude = extension_filters(params)
+    recursive = any(param in ("-r", "-recurse") for param in params)
+    files = []
+    for root, dirs, names in os.walk(folder):
+        if recursive:
+            dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+        else:
+            dirs[:] = []
+        for name in sorted(names):
+            if name.startswith('.') or name in PIPELINE_FILES or ROTATED_LOG.match(name):
+                continue
+            extension = os.path.splitext(name)[1].lstrip('.').lower()
+            if extension in exclude or (include and extension not in include):
+                continue
+            files.append(os.path.join(root, name))
+    return files
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+class Manifest:
+    """Per-folder cache of each file's stat signature and extracted tags.
+
+    A file whose (size, mtime, inode) signature is unchanged since the last
+    scan doesn't need to go through exiftool again; its cached record is
+    reused. The cache is dropped when the exiftool command changes, since
+    the record would then hold a different set of tags. The records of a
+    folder stay in memory until it is finished, so they share their
+    repeated values through an Interner.
+    """
+
+    def __init__(self, path, command_key):
+        self.path = path
+        self.command_key = command_key
+        # path -> [size, mtime_ns, inode, record or None]
+        self.entries = {}
+        self.interner = Interner()
+
+    @classmethod
+    def for_folder(cls, folder, params):
+        return cls.load(os.path.join(folder, MANIFEST_NAME), "\0".join(params))
+
+    @classmethod
+    def load(cls, path, command_key):
+        manifest = cls(path, command_key)
+        try:
+            with open(path, 'rb') as f:
+                data = codec.loads(f.read())
+        except (OSError, ValueError):
+            return manifest
+        if data.get("version") == MANIFEST_VERSION and data.get("command") == command_key:
+            manifest.entries = {path: entry[:3] + [manifest.compact(entry[3])]
+                                for path, entry in data.get("files", {}).items()}
+        return manifest
+
+    def compact(self, record):
+        return self.interner.compact(record) if record is not None else None
+
+    def is_current(self, path, signature):
+        entry = self.entries.get(path)
+        return entry is not None and entry[:3] == signature
+
+    def record(self, path):
+        entry = self.entries.get(path)
+        return entry[3] if entry is not None else None
+
+    def update(self, path, signature, record):
+        self.entries[path] = signature + [self.compact(record)]
+
+    def prune(self, paths):
+        # Forget files that are gone from the folder
+        paths = set(paths)
+        for path in [path for path in self.entries if path not in paths]:
+            del self.entries[path]
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(codec.dumps({"version": MANIFEST_VERSION, "command": self.command_key, "files": self.entries}))
+        os.replace(temp_path, self.path)
@@ -0,0 +1,250 @@
+import re
+
+
+def parse_pattern_list(text):
+    # Comma separated list from the UI; blank entries would match everything
+    return [item.strip() for item in text.split(',') if item.strip()]
+
+
+def _join_stripped(before, after):
+    # Join the text around a removed match without the blanks next to it
+    left, right = before.rstrip(" \t"), after.lstrip(" \t")
+    separated = (left != before or right != after) and left and right
+    if separated and not left.endswith("\n") and not right.startswith("\n"):
+        return left + " " + right
+    return left + right
+
+
+def _literal_trie_regex(words, whole_word):
+    # Build one regex from a trie of the words so shared prefixes (e.g.
+    # hundreds of "Face_" tags) are only tested once per position. With
+    # whole_word the longest word always matches; otherwise a shorter word
+    # that is a prefix of a longer one is enough for a search.
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = None
+    return _trie_node_regex(trie, whole_word)
+
+
+def _trie_node_regex(node, whole_word):
+    ends_here = '' in node
+    if ends_here and not whole_word:
+        # For a substring search a shorter word already decides the match
+        return ''
+    alternatives = [re.escape(char) + _trie_node_regex(child, whole_word)
+                    for char, child in sorted(node.items()) if char]
+    if not alternatives:
+        return ''
+    if len(alternatives) == 1:
+        regex = alternatives[0]
+    else:
+        regex = '(?:' + '|'.join(alternatives) + ')'
+    if ends_here:
+        regex = '(?:' + regex + ')?'
+    return regex
+
+
+class _PatternList:
+    # Regex patterns searched one at a time. In one alternation the groups
+    # of all patterns share one numbering, so a backreference would point
+    # at another pattern's group; patterns with groups are kept apart.
+    def __init__(self, patterns, flags):
+        self.patterns = [re.compile(pattern, flags) for pattern in patterns]
+
+    def search(self, text):
+        for pattern in self.patterns:
+            match = pattern.search(text)
+            if match is not None:
+                return match
+        return None
+
+    def finditer(self, text):
+        # The matches an alternation of the patterns would find: the
+        # leftmost at each point, the first pattern on a tie
+        position = 0
+        while position <= len(text):
+            matches = [match for match in (pattern.search(text, position) for pattern in self.patterns)
+                       if match is not None]
+            if not matches:
+                return
+            match = min(matches, key=lambda match: match.start())
+            yield match
+            position = match.end() + (match.end() == match.start())
+
+    def sub(self, replacement, text):
+        # Group references in replacement refer to the pattern that matched
+        pieces = []
+        end = 0
+        for match in self.finditer(text):
+            pieces += [text[end:match.start()], match.expand(replacement)]
+            end = match.end()
+        pieces.append(text[end:])
+        return "".join(pieces)
+
+
+class TagMatcher:
+    """Decide which tag values to remove.
+
+    The replace and keep lists are compiled once into a single regex, so
+    each value is classified in one scan instead of one substring search
+    per pattern. A value is removed if it contains a replace pattern and
+    no keep pattern. substitute() rewrites the matched parts instead.
+    Regex patterns with capture groups are searched one by one, so their
+    backreferences keep their meaning.
+    """
+
+    def __init__(self, replace_list, not_replace_list, case_insensitive=False, whole_word=False, regex=False):
+        self.replace_list = [item for item in replace_list if item]
+        self.not_replace_list = [item for item in not_replace_list if item]
+        self.case_insensitive = case_insensitive
+        self.whole_word = whole_word
+        self.regex = regex
+        # Built by find_patterns() on first use
+        self._trie = None
+        self._singles = {}
+        # Built by could_match() on first use
+        self._anywhere = None
+
+        flags = re.IGNORECASE if case_insensitive else 0
+        self._flags = flags
+        drop = self._alternation(self.replace_list)
+        keep = self._alternation(self.not_replace_list)
+        try:
+            self._drop = self._compile(self.replace_list, flags)
+            self._keep = self._compile(self.not_replace_list, flags)
+            # substitute() needs the longest match at each position, which
+            # the search regex of a substring match doesn't promise
+            self._sub = self._drop
+            if drop is not None and not regex and not whole_word:
+                self._sub = re.compile(self._alternation(self.replace_list, longest=True), flags)
+            # The lookahead matches at every position without consuming
+            # text, so a keep pattern overlapping a replace pattern is
+            # still seen. Keep is tried first and wins ties.
+            self._combined = None
+            if isinstance(self._drop, re.Pattern) and isinstance(self._keep, re.Pattern):
+                self._combined = re.compile(f'(?=(?P<keep>{keep})|(?P<drop>{drop}))', flags)
+        except re.error as e:
+            raise ValueError(f"Invalid pattern: {e}") from e
+
+    def _compile(self, patterns, flags):
+        if not patterns:
+            return None
+        if self.regex and any(re.compile(pattern).groups for pattern in patterns):
+            return _PatternList([self._alternation([pattern]) for pattern in patterns], flags)
+        return re.compile(self._alternation(patterns), flags)
+
+    def _alternation(self, patterns, longest=False):
+        if not patterns:
+            return None
+        if self.regex:
+            regex = '|'.join(f'(?:{pattern})' for pattern in patterns)
+        else:
+            words = patterns
+            if self.case_insensitive:
+                words = {word.lower() for word in words}
+            regex = _literal_trie_regex(words, self.whole_word or longest)
+        if self.whole_word:
+            regex = rf'(?<!\w)(?:{regex})(?!\w)'
+        return regex
+
+    def should_remove(self, item):
+        if self._drop is None or not isinstance(item, str):
+            return False
+        if self._combined is None:
+            if self._keep is not None and self._keep.search(item) is not None:
+                return False
+            return self._drop.search(item) is not None
+        contains_replace_word = False
+        for match in self._combined.finditer(item):
+            if match.group('keep') is not None:
+                return False
+            contains_replace_word = True
+        return contains_replace_word
+
+    def could_match(self, text):
+        # True if text contains a replace pattern anywhere, keep patterns
+        # aside; used to search whole metadata blocks at once. Literal
+        # patterns are searched as plain substrings even with whole_word,
+        # since the bytes next to a value in a block (an IPTC length, say)
+        # may well be word characters.
+        if self._drop is None:
+            return False
+        if self.regex:
+            return self._drop.search(text) is not None
+        if self._anywhere is None:
+            words = self.replace_list
+            if self.case_insensitive:
+                words = {word.lower() for word in words}
+            self._anywhere = re.compile(_literal_trie_regex(words, False), self._flags)
+        return self._anywhere.search(text) is not None
+
+    def find_patterns(self, item):
+        # The indexes in replace_list of the patterns item contains, keep
+        # patterns aside. Literal patterns are looked up in a trie from
+        # each position of item, so hundreds of them cost about as much as
+        # one; only the ones found are checked for word boundaries. Regex
+        # patterns are searched one by one.
+        if self.regex:
+            return [index for index in range(len(self.replace_list)) if self._single(index).search(item)]
+        text = item.lower() if self.case_insensitive else item
+        trie = self._pattern_trie()
+        found = set()
+        for start in range(len(text)):
+            node = trie
+            for char in text[start:]:
+                node = node.get(char)
+                if node is None:
+                    break
+                found.update(node.get('', ()))
+        if self.whole_word:
+            found = {index for index in found if self._single(index).search(item)}
+        return sorted(found)
+
+    def _pattern_trie(self):
+        if self._trie is None:
+            self._trie = {}
+            for index, pattern in enumerate(self.replace_list):
+                node = self._trie
+                for char in pattern.lower() if self.case_insensitive else pattern:
+                    node = node.setdefault(char, {})
+                node.setdefault('', []).append(index)
+        return self._trie
+
+    def _single(self, index):
+        # The regex of one replace pattern
+        single = self._singles.get(index)
+        if single is None:
+            single = self._singles[index] = re.compile(self._alternation([self.replace_list[index]]), self._flags)
+        return single
+
+    def substitute(self, item, replacement):
+        # Replace every match of the replace patterns in a value that
+        # should_remove(). Regex patterns may refer to their groups in
+        # replacement; otherwise it is taken literally.
+        if not self.should_remove(item):
+            return item
+        if self.regex:
+            return self._sub.sub(replacement, item)
+        return self._sub.sub(lambda match: replacement, item)
+
+    def strip(self, item):
+        # Remove every match of the replace patterns from a value that
+        # should_remove(), with the spaces and tabs right next to it. Words
+        # the match stood between keep one space; the rest of the value,
+        # line breaks included, is left as it is.
+        if not self.should_remove(item):
+            return item
+        result = None
+        end = 0
+        for match in self._sub.finditer(item):
+            if match.end() == match.start():
+                continue
+            piece = item[end:match.start()]
+            result = piece if result is None else _join_stripped(result, piece)
+            end = match.end()
+        if result is None:
+            return item
+        return _join_stripped(result, item[end:])
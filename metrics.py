@@ -0,0 +1,286 @@
+"""Per-stage and per-folder run metrics.
+
+A RunMetrics object is handed to the pipeline functions, which record
+wall time, file and byte counts, exiftool call latencies and queue depths
+into it; without one they record into a throwaway object. At the end of a
+run it is saved as a JSON report or as a Prometheus textfile for the node
+exporter's textfile collector:
+
+    metrics = RunMetrics(profile_dir="profiles")
+    run_scan(folder, command, pool, metrics=metrics)
+    metrics.write_json("run.json")
+    metrics.write_prometheus("remove_tag.prom")
+
+With profile_dir set, every worker thread (and every replace job in a
+worker process) is run under cProfile and its stats are dumped there, to
+be read with pstats or snakeviz.
+"""
+import os
+import json
+import time
+import bisect
+import cProfile
+import threading
+import contextlib
+from itertools import count
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+FOLDER_COUNTERS = ("processed", "changed", "skipped", "quarantined", "bytes_read", "bytes_written", "busy_seconds")
+
+PROMETHEUS_PREFIX = "remove_tag"
+
+_profile_ids = count()
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def cumulative(self):
+        # (upper bound, observations at or below it), ending with +Inf
+        total = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), self.counts):
+            total += bucket_count
+            yield bound, total
+
+    def to_dict(self):
+        return {"count": self.count, "sum": round(self.sum, 6), "max": round(self.max, 6),
+                "mean": round(self.sum / self.count, 6) if self.count else None,
+                "buckets": {("+Inf" if bound == float("inf") else str(bound)): total
+                            for bound, total in self.cumulative()}}
+
+
+class QueueGauge:
+    # Samples of one queue's depth: last, maximum and mean
+    def __init__(self):
+        self.last = 0
+        self.max = 0
+        self.total = 0
+        self.samples = 0
+
+    def sample(self, depth):
+        self.last = depth
+        self.max = max(self.max, depth)
+        self.total += depth
+        self.samples += 1
+
+    def to_dict(self):
+        return {"last": self.last, "max": self.max,
+                "mean": round(self.total / self.samples, 2) if self.samples else None, "samples": self.samples}
+
+
+class StageMetrics:
+    """Metrics of one stage, shared by all of its worker threads."""
+
+    def __init__(self, run, name):
+        self.run = run
+        self.name = name
+        self.lock = threading.Lock()
+        self.started = None
+        self.seconds = 0.0
+        self.folders = {}
+        self.histograms = {}
+        self.queues = {}
+
+    @contextlib.contextmanager
+    def timer(self):
+        # Adds the wall time of the block to the stage; a stage run twice
+        # (e.g. scan, then rescan) adds up
+        start = time.perf_counter()
+        with self.lock:
+            if self.started is None:
+                self.started = time.time()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.seconds += elapsed
+
+    def add(self, folder, **counters):
+        # Adds to the counters of a folder, see FOLDER_COUNTERS
+        with self.lock:
+            totals = self.folders.get(folder)
+            if totals is None:
+                totals = self.folders[folder] = dict.fromkeys(FOLDER_COUNTERS, 0)
+            for name, value in counters.items():
+                totals[name] += value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        # Observes the duration of the block in histogram name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def queue_depth(self, name, depth):
+        with self.lock:
+            gauge = self.queues.get(name)
+            if gauge is None:
+                gauge = self.queues[name] = QueueGauge()
+            gauge.sample(depth)
+
+    def profile(self):
+        # Profiles the calling worker thread when the run has a profile_dir
+        return profiled(self.run.profile_dir, self.name)
+
+    def totals(self):
+        totals = dict.fromkeys(FOLDER_COUNTERS, 0)
+        for folder_totals in self.folders.values():
+            for name, value in folder_totals.items():
+                totals[name] += value
+        return totals
+
+    def to_dict(self):
+        with self.lock:
+            seconds = self.seconds
+            totals = self.totals()
+            return {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)) if self.started else None,
+                "seconds": round(seconds, 4),
+                "files_per_sec": round(totals["processed"] / seconds, 1) if seconds else None,
+                "totals": {name: round(value, 4) for name, value in totals.items()},
+                "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+                "queues": {name: gauge.to_dict() for name, gauge in self.queues.items()},
+                # Slowest folders first
+                "folders": {folder: {name: round(value, 4) for name, value in folder_totals.items()}
+                            for folder, folder_totals in sorted(self.folders.items(),
+                                                                key=lambda item: item[1]["busy_seconds"],
+                                                                reverse=True)},
+            }
+
+
+class RunMetrics:
+    """Metrics of one run, made of one StageMetrics per stage."""
+
+    def __init__(self, profile_dir=None):
+        self.profile_dir = profile_dir
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def stage(self, name):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = StageMetrics(self, name)
+            return stage
+
+    def report(self):
+        return {"started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "seconds": round(time.time() - self.started, 4),
+                "stages": {name: stage.to_dict() for name, stage in self.stages.items()}}
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def prometheus_lines(self):
+        prefix = PROMETHEUS_PREFIX
+        families = {
+            "stage_seconds": ("gauge", "Wall time of the stage in seconds."),
+            "folder_files_total": ("counter", "Files of a folder handled by the stage, by result."),
+            "folder_bytes_total": ("counter", "Bytes of a folder read or written by the stage."),
+            "folder_busy_seconds_total": ("counter", "Time the stage's workers spent on a folder."),
+            "latency_seconds": ("histogram", "Duration of exiftool calls and per-file work."),
+            "queue_depth_max": ("gauge", "Largest sampled depth of a work queue."),
+            "queue_depth_mean": ("gauge", "Mean sampled depth of a work queue."),
+        }
+        samples = {family: [] for family in families}
+        for stage_name, stage in self.stages.items():
+            with stage.lock:
+                samples["stage_seconds"].append(({"stage": stage_name}, stage.seconds))
+                for folder, totals in stage.folders.items():
+                    labels = {"stage": stage_name, "folder": folder}
+                    for result in ("processed", "changed", "skipped", "quarantined"):
+                        samples["folder_files_total"].append((dict(labels, result=result), totals[result]))
+                    samples["folder_bytes_total"].append((dict(labels, direction="read"), totals["bytes_read"]))
+                    samples["folder_bytes_total"].append((dict(labels, direction="written"), totals["bytes_written"]))
+                    samples["folder_busy_seconds_total"].append((labels, totals["busy_seconds"]))
+                for name, histogram in stage.histograms.items():
+                    labels = {"stage": stage_name, "operation": name}
+                    for bound, total in histogram.cumulative():
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        samples["latency_seconds"].append((dict(labels, le=le), total, "_bucket"))
+                    samples["latency_seconds"].append((labels, histogram.sum, "_sum"))
+                    samples["latency_seconds"].append((labels, histogram.count, "_count"))
+                for name, gauge in stage.queues.items():
+                    labels = {"stage": stage_name, "queue": name}
+                    samples["queue_depth_max"].append((labels, gauge.max))
+                    samples["queue_depth_mean"].append((labels, gauge.total / gauge.samples if gauge.samples else 0))
+
+        for family, (metric_type, help_text) in families.items():
+            name = f"{prefix}_{family}"
+            yield f"# HELP {name} {help_text}"
+            yield f"# TYPE {name} {metric_type}"
+            for sample in samples[family]:
+                labels, value = sample[0], sample[1]
+                suffix = sample[2] if len(sample) > 2 else ""
+                label_text = ",".join(f'{key}="{_escape_label(label)}"' for key, label in labels.items())
+                yield f"{name}{suffix}{{{label_text}}} {value}"
+
+    def write_prometheus(self, path):
+        # The textfile collector may read at any moment, so the file is
+        # replaced atomically
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(self.prometheus_lines()) + "\n")
+        os.replace(temp_path, path)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+@contextlib.contextmanager
+def profiled(profile_dir, name):
+    """Run the block under cProfile and dump its stats into profile_dir.
+
+    Does nothing without a profile_dir, or when another profiler is
+    already active in this interpreter (Python 3.12 allows only one).
+    """
+    if not profile_dir:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(
+            profile_dir, f"{name}-{os.getpid()}-{threading.get_ident()}-{next(_profile_ids)}.prof"))
+
+
+def profile_call(profile_dir, name, function, *args):
+    # Picklable wrapper for work submitted to a process pool
+    with profiled(profile_dir, name):
+        return function(*args)
@@ -0,0 +1,845 @@
+"""Qt-free core of the scan, replace and write stages.
+
+The GUI in remove_tag_from_metadata.py and the headless CLI in cli.py are
+both thin layers over the functions here; nothing in this module imports
+PyQt.
+"""
+import os
+import re
+import time
+import logging
+import shlex
+import queue
+import tempfile
+import threading
+import contextlib
+from collections import namedtuple
+from logging.handlers import RotatingFileHandler
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import codec
+from exiftool import fsencode, ExifToolTimeout
+from jsonstream import iter_json_file, JsonArrayWriter
+from manifest import Manifest, list_files, file_signature
+from journal import WriteJournal, update_digest
+from metrics import RunMetrics, profile_call
+from rules import as_ruleset
+from interning import Interner
+from keyword_index import save_folder_index
+from quarantine import Quarantine, QUARANTINE_NAME
+
+DEFAULT_SCAN_COMMAND = (
+    "exiftool -r -progress -j -G --ext .txt --ext .csv --ext .db --ext .args --ext .json -exif:DateTimeOriginal "
+    "-exif:ModifyDate -exif:Model -exif:CameraModelName -exif:ISO -exif:Notes -exif:ImageDescription -exif:UserComment "
+    "-exif:GPSLongitude -exif:GPSLatitude -iptc:Sub-location -iptc:City -iptc:Province-State "
+    "-iptc:Country-PrimaryLocationName -iptc:Category -iptc:Headline -iptc:Caption -iptc:Source "
+    "-iptc:Caption-Abstract -iptc:Notes -iptc:FixtureIdentifier -iptc:Contact -iptc:Keywords -xmp:Event "
+    "-xmp:Location -xmp:Sub-location -xmp:City -xmp:Province-State -xmp:Country-PrimaryLocationName "
+    "-xmp:Description -xmp:UserComment -xmp:Keywords -xmp:People -xmp:PersonInImage -xmp:TagsList "
+    "-xmp:CatalogSets -xmp:HierarchicalSubject -xmp:RegionAppliedToDimensions -xmp:RegionArea "
+    "-xmp:RegionExtensions -xmp:RegionName -xmp:RegionPersonDisplayName -xmp:RegionRectangle -xmp:RegionType "
+    "-xmp:RegionUnit")
+
+# Messages of the write stage, like the number of files a resumed run skips
+logger = logging.getLogger(__name__)
+
+# -f makes exiftool delete the tags set to rules.DELETE_VALUE
+WRITE_PARAMS = ["-progress", "-v", "-f", "-preserve_original", "-m", "-overwrite_original_in_place"]
+
+# exiftool_output.txt is rotated at this size, keeping this many old copies
+OUTPUT_LOG_MAX_BYTES = 10 * 1024 * 1024
+OUTPUT_LOG_BACKUPS = 3
+
+# Seconds exiftool may go without any output before a call is given up
+# on. Both stages run exiftool with -progress, which prints a line per
+# file, so this is the time allowed for a single file.
+DEFAULT_TIMEOUT = 120
+
+# A write stays silent while exiftool rewrites a file, and killing it as it
+# copies the new file back over the original (-overwrite_original_in_place)
+# can truncate the original. The timeout of a write call therefore grows
+# by a second for every this many bytes of its largest file, a rate even a
+# slow share keeps up.
+WRITE_BYTES_PER_SECOND = 1024 * 1024
+
+# "======== FILE [N/M]", printed by -progress as exiftool starts on a file
+_PROGRESS_LINE = re.compile(rb"^======== .*\[(\d+)/(\d+)\]\s*$")
+
+
+def get_list_of_json_files(folder_path):
+    # The output.json files below folder_path, in whichever compression
+    json_files = []
+    for root, dirs, files in os.walk(folder_path):
+        for name in sorted({codec.strip_suffix(file) for file in files}):
+            if name.endswith("output.json"):
+                json_files.append(codec.find_intermediate(root, name))
+    return json_files
+
+
+def modified_json_path(file_path):
+    # modified.json of an output.json, compressed like it
+    return os.path.join(os.path.dirname(file_path),
+                        "modified.json" + codec.SUFFIXES[codec.compression_of(file_path)])
+
+
+def list_scan_folders(folder_path):
+    # Every top-level folder is scanned on its own
+    return [os.path.join(folder_path, name) for name in sorted(os.listdir(folder_path))
+            if os.path.isdir(os.path.join(folder_path, name))]
+
+
+def list_year_folders(folder_path):
+    # Year folders, from lowest to highest
+    year_folders = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if
+                    os.path.isdir(os.path.join(folder_path, f)) and f.isdigit()]
+    return sorted(year_folders, key=lambda x: int(os.path.basename(x)))
+
+
+def command_params(command):
+    # Split an exiftool command line into arguments for a stay_open
+    # process, dropping the executable name itself
+    params = shlex.split(command)
+    if params and os.path.basename(params[0]).lower().startswith("exiftool"):
+        params = params[1:]
+    return params
+
+
+def stderr_errors(stderr, ignore_unknown_type=False):
+    # exiftool reports failures as "Error: ..." lines on stderr. Named files
+    # of an unknown type are errors, while a directory scan skips them quietly.
+    errors = [line for line in stderr.decode('utf-8', 'replace').splitlines() if line.startswith("Error")]
+    if ignore_unknown_type:
+        errors = [line for line in errors if "Unknown file type" not in line]
+    return errors
+
+
+# Scan stage
+
+class FolderScan:
+    """Scan state of one folder while its shards are in flight.
+
+    Only new or modified files are pending; everything else comes from the
+    manifest of the previous scan. Shard results are merged back into the
+    manifest, and output.json and the keyword index are written once the
+    last shard is in. output.json is compressed with compression, one of
+    codec.COMPRESSIONS.
+    """
+
+    def __init__(self, folder, params, incremental=True, compression="none"):
+        self.folder = folder
+        self.output_path = os.path.join(folder, "output.json" + codec.SUFFIXES[codec.check_compression(compression)])
+        self.manifest = Manifest.for_folder(folder, params)
+        if not incremental:
+            self.manifest.entries = {}
+        self.files = list_files(folder, params)
+        self.signatures = {path: file_signature(path) for path in self.files}
+        self.pending = [path for path in self.files if not self.manifest.is_current(path, self.signatures[path])]
+        self.pending_bytes = sum(self.signatures[path][0] for path in self.pending)
+        self.remaining_shards = 0
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def shards(self, shard_size):
+        shards = [self.pending[start:start + shard_size] for start in range(0, len(self.pending), shard_size)]
+        self.remaining_shards = len(shards)
+        return shards
+
+    def add_results(self, shard, records, errors, skipped=()):
+        # Returns True when this was the last outstanding shard. skipped
+        # files were left out by a prefilter and aren't cached, so a scan
+        # with other patterns reads them; they have no record until then.
+        with self.lock:
+            for path in shard:
+                # Files exiftool can't read are cached too, so they aren't retried
+                self.manifest.update(path, self.signatures[path], records.get(os.path.normpath(path)))
+            for path in skipped:
+                self.manifest.entries.pop(path, None)
+            self.errors.extend(errors)
+            self.remaining_shards -= 1
+            return self.remaining_shards == 0
+
+    def add_failure(self, error):
+        # A failed shard keeps its old manifest entries, so its files are
+        # retried on the next scan
+        with self.lock:
+            self.errors.append(error)
+            self.remaining_shards -= 1
+            return self.remaining_shards == 0
+
+    def records(self):
+        # The current record of every file exiftool could read
+        for path in self.files:
+            record = self.manifest.record(path)
+            if record is not None:
+                yield record
+
+    def finish(self):
+        self.manifest.prune(self.files)
+        temp_path = self.output_path + ".tmp"
+        with codec.open_file(temp_path, "wb", codec.compression_of(self.output_path)) as json_output_file:
+            with JsonArrayWriter(json_output_file) as writer:
+                for record in self.records():
+                    writer.write(record)
+        codec.replace_intermediate(temp_path, self.output_path)
+        save_folder_index(self.folder, self.records())
+        self.manifest.save()
+
+
+def run_bisecting(items, run, on_timeout):
+    # Call run(items) and return its result in a list. If exiftool times
+    # out, the halves of items are run on their own, down to single items,
+    # and on_timeout is called with every item that times out alone. The
+    # results of the calls that finished are returned in order.
+    try:
+        return [run(items)]
+    except ExifToolTimeout:
+        if len(items) == 1:
+            on_timeout(items[0])
+            return []
+    middle = len(items) // 2
+    return run_bisecting(items[:middle], run, on_timeout) + run_bisecting(items[middle:], run, on_timeout)
+
+
+def quarantined_split(paths, quarantined):
+    # (paths to process, quarantined paths), in their order
+    if not quarantined:
+        return paths, []
+    keep, skipped = [], []
+    for path in paths:
+        (skipped if os.path.normpath(path) in quarantined else keep).append(path)
+    return keep, skipped
+
+
+def limited_call(limiter, stage_metrics, paths):
+    # The slot of an exiftool call over paths in a
+    # concurrency.AdaptiveLimiter; the limit is sampled into the metrics
+    if limiter is None:
+        return contextlib.nullcontext()
+    stage_metrics.queue_depth("exiftool_limit", limiter.limit)
+    return limiter.slot(len(paths), sum(file_size(path) for path in paths))
+
+
+def scan_shard(shard, params, pool, stage_metrics=None, timeout=None, on_timeout=None, limiter=None):
+    # Run exiftool on one shard, returning its records by path and errors.
+    # Named files of an unknown type are skipped quietly, as in a
+    # directory scan. With a timeout, a shard exiftool hangs on is
+    # bisected; the files that hang on their own have no record and are
+    # passed to on_timeout. Each call holds a slot of limiter.
+    stage_metrics = stage_metrics or RunMetrics().stage("scan")
+    errors = []
+
+    def read(files):
+        with limited_call(limiter, stage_metrics, files), pool.acquire() as et, \
+                stage_metrics.measure("exiftool_read"):
+            stdout = et.execute(*[fsencode(param) for param in params + files], timeout=timeout)
+            stderr = et.last_stderr
+        return codec.loads(stdout or b"[]"), stderr_errors(stderr, ignore_unknown_type=True)
+
+    def timed_out(path):
+        errors.append(f"Timed out reading {path}, see {QUARANTINE_NAME}")
+        if on_timeout:
+            on_timeout(path)
+
+    records = {}
+    for shard_records, shard_errors in run_bisecting(shard, read, timed_out):
+        records.update((os.path.normpath(record["SourceFile"]), record) for record in shard_records)
+        errors.extend(shard_errors)
+    return records, errors
+
+
+def scan_folders(folders, params, pool, incremental=True, shard_size=500, on_folder_done=None, metrics=None,
+                 catalog=None, compression="none", prefilter=None, timeout=DEFAULT_TIMEOUT, quarantine=None,
+                 limiter=None):
+    """Write output.json for each folder, compressed with compression.
+
+    The pending files of all folders are cut into shards of shard_size
+    files that go into one shared queue. One worker per pool process pulls
+    shards until the queue is empty, so a huge folder is spread over all
+    processes instead of setting the pace on its own. With a catalog, the
+    records of each finished folder are loaded into it as well. With a
+    prefilter.Prefilter, the workers leave out the files it rules out, and
+    output.json only lists the others.
+
+    exiftool may stay silent for timeout seconds (None waits forever)
+    before its process is killed and the shard is bisected, so one file
+    that hangs exiftool costs a few timeouts instead of the whole run.
+    Such files are added to the quarantine.Quarantine, whose files are
+    left out of every scan.
+
+    With a concurrency.AdaptiveLimiter, only as many workers as it allows
+    run exiftool at a time. Returns the error messages.
+    """
+    stage = (metrics or RunMetrics()).stage("scan")
+    with stage.timer():
+        return _scan_folders(folders, params, pool, incremental, shard_size, on_folder_done, stage, catalog,
+                             compression, prefilter, timeout, quarantine, limiter)
+
+
+def _scan_folders(folders, params, pool, incremental, shard_size, on_folder_done, stage, catalog, compression,
+                  prefilter, timeout, quarantine, limiter):
+    quarantined = quarantine.paths() if quarantine is not None else set()
+    errors = []
+    errors_lock = threading.Lock()
+
+    def folder_done(scan):
+        start = time.perf_counter()
+        try:
+            scan.finish()
+            if catalog is not None:
+                catalog.replace_folder(scan.folder, scan.records())
+        except Exception as e:
+            scan.errors.append(str(e))
+        # Files served from the manifest count as skipped
+        stage.add(scan.folder, skipped=len(scan.files) - len(scan.pending),
+                  bytes_written=file_size(scan.output_path),
+                  busy_seconds=time.perf_counter() - start)
+        with errors_lock:
+            if scan.errors:
+                errors.append(f"Error processing folder: {scan.folder}\n" + "\n".join(scan.errors))
+        if on_folder_done:
+            on_folder_done(scan.folder, f"{scan.folder}: {len(scan.pending)} of {len(scan.files)} files scanned")
+
+    # Listing and stat'ing is I/O bound as well, so folders are listed in parallel
+    scans = []
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        futures = {executor.submit(FolderScan, folder, params, incremental, compression): folder
+                   for folder in folders}
+        for future in as_completed(futures):
+            try:
+                scans.append(future.result())
+            except Exception as e:
+                errors.append(f"Error processing folder: {futures[future]}\n{str(e)}")
+
+    # Shards of the largest folders go first
+    work = queue.Queue()
+    for scan in sorted(scans, key=lambda scan: len(scan.pending), reverse=True):
+        shards = scan.shards(shard_size)
+        if not shards:
+            folder_done(scan)
+        for shard in shards:
+            work.put((scan, shard))
+
+    def worker():
+        with stage.profile():
+            while True:
+                stage.queue_depth("shards", work.qsize())
+                try:
+                    scan, shard = work.get_nowait()
+                except queue.Empty:
+                    return
+                start = time.perf_counter()
+                candidates, skipped = quarantined_split(shard, quarantined)
+                stuck = set()
+
+                def timed_out(path, folder=scan.folder):
+                    stuck.add(path)
+                    stage.add(folder, quarantined=1)
+                    if quarantine is not None:
+                        quarantine.add(path, "scan")
+
+                try:
+                    if prefilter is not None:
+                        with stage.measure("prefilter"):
+                            candidates, filtered = prefilter.split(candidates)
+                        skipped += filtered
+                    records, shard_errors = (scan_shard(candidates, params, pool, stage, timeout, timed_out, limiter)
+                                             if candidates else ({}, []))
+                except Exception as e:
+                    last = scan.add_failure(str(e))
+                else:
+                    # Quarantined files aren't cached, so they are read
+                    # again once they leave the quarantine
+                    last = scan.add_results([path for path in candidates if path not in stuck], records,
+                                            shard_errors, skipped + sorted(stuck))
+                stage.add(scan.folder, processed=len(shard), skipped=len(skipped),
+                          bytes_read=sum(scan.signatures[path][0] for path in shard),
+                          busy_seconds=time.perf_counter() - start)
+                if last:
+                    folder_done(scan)
+
+    workers = [threading.Thread(target=worker) for _ in range(min(pool.size, work.qsize()))]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return errors
+
+
+def run_scan(folder_path, command, pool, incremental=True, shard_size=500, on_folder_done=None, metrics=None,
+             catalog=None, compression="none", prefilter=None, timeout=DEFAULT_TIMEOUT, limiter=None):
+    # Scan all top-level folders, with the quarantine list of folder_path.
+    # Returns the list of error messages. The folder is made absolute, so
+    # the SourceFile of every record is as well.
+    folder_path = os.path.abspath(folder_path)
+    return scan_folders(list_scan_folders(folder_path), command_params(command), pool, incremental,
+                        shard_size, on_folder_done, metrics, catalog, compression, prefilter, timeout,
+                        Quarantine.for_folder(folder_path), limiter)
+
+
+# Replace stage
+
+def process_record(image_data, matcher):
+    # Returns the number of removed or changed values and a record holding
+    # the SourceFile and only the tags that changed, or None if nothing
+    # did. matcher is a RuleSet, or a TagMatcher that removes matching
+    # items of list-valued tags; callers handling many records should
+    # pass a RuleSet so its dispatch plan is reused.
+    return as_ruleset(matcher).apply(image_data)
+
+
+def process_json_data(data, matcher):
+    # In-memory variant of replace_file(): returns the number of removed
+    # values and the delta records to write
+    matcher = as_ruleset(matcher)
+    removed_count = 0
+    changes = []
+    for image_data in data:
+        count, change = process_record(image_data, matcher)
+        removed_count += count
+        if change is not None:
+            changes.append(change)
+    return removed_count, changes
+
+
+ReplaceResult = namedtuple("ReplaceResult", ["removed", "records", "changed", "seconds"])
+
+
+def replace_file(file_path, matcher):
+    """Write modified.json next to an output.json and return the number of
+    removed values.
+
+    Records are streamed one at a time so memory stays flat however large
+    output.json is. Only the changed files and tags are saved, so the write
+    stage leaves every other file alone. An empty list still replaces the
+    result of an earlier run. modified.json is compressed like output.json.
+    """
+    return replace_file_counts(file_path, matcher).removed
+
+
+def replace_file_counts(file_path, matcher):
+    # replace_file() returning a ReplaceResult with the number of removed
+    # values, records read and records changed, and the time it took
+    start = time.perf_counter()
+    matcher = as_ruleset(matcher)
+    num_changes = num_records = num_changed = 0
+    modified_file_path = modified_json_path(file_path)
+    temp_file_path = modified_file_path + '.tmp'
+    try:
+        with codec.open_file(temp_file_path, 'wb', codec.compression_of(modified_file_path)) as modified_json_file:
+            with JsonArrayWriter(modified_json_file) as writer:
+                for image_data in iter_json_file(file_path):
+                    count, change = process_record(image_data, matcher)
+                    num_changes += count
+                    num_records += 1
+                    if change is not None:
+                        num_changed += 1
+                        writer.write(change)
+        codec.replace_intermediate(temp_file_path, modified_file_path)
+    except BaseException:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+        raise
+    return ReplaceResult(num_changes, num_records, num_changed, time.perf_counter() - start)
+
+
+def run_replace(folder_path, matcher, on_file_done=None, backend="process", max_workers=None, metrics=None):
+    """Run replace_file() for every output.json below folder_path.
+
+    The work is pure-Python parsing and matching, so the "process" backend
+    spreads it over worker processes to get past the GIL; "thread" keeps it
+    in this process. The largest files start first so a single big year
+    doesn't end up running alone at the end. Only counts and error
+    messages come back to the caller. Returns the total number of removed
+    values and the error messages.
+    """
+    metrics = metrics or RunMetrics()
+    stage = metrics.stage("replace")
+    matcher = as_ruleset(matcher)
+    json_files = get_list_of_json_files(folder_path)
+    sizes = {file_path: os.path.getsize(file_path) for file_path in json_files}
+    json_files.sort(key=sizes.get, reverse=True)
+    executor_class = ProcessPoolExecutor if backend == "process" else ThreadPoolExecutor
+    total_changes, errors = 0, []
+    with stage.timer(), executor_class(max_workers=max_workers) as executor:
+        # Each job is profiled on its own, in whichever process runs it
+        futures = {executor.submit(profile_call, metrics.profile_dir, "replace", replace_file_counts, file_path,
+                                   matcher): file_path for file_path in json_files}
+        for remaining, future in enumerate(as_completed(futures), 1):
+            stage.queue_depth("files", len(futures) - remaining)
+            file_path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                errors.append(f"Error processing file: {file_path}\n{str(e)}")
+                continue
+            stage.observe("replace_file", result.seconds)
+            stage.add(os.path.dirname(file_path), processed=result.records, changed=result.changed,
+                      skipped=result.records - result.changed, bytes_read=sizes[file_path],
+                      bytes_written=file_size(modified_json_path(file_path)),
+                      busy_seconds=result.seconds)
+            total_changes += result.removed
+            if on_file_done:
+                on_file_done(file_path, result.removed)
+    return total_changes, errors
+
+
+# Write stage
+
+class OutputLogs:
+    """Rotating exiftool_output.txt logs, one per log directory, and the
+    errors.txt files of the written directories.
+
+    exiftool's output is logged line by line as it arrives. Each log is
+    capped at max_bytes and rotated to exiftool_output.1.txt and so on, so
+    a verbose run neither piles up in memory nor fills the disk. Batches
+    written at the same time share the handler of their log directory,
+    which keeps their lines whole. An errors.txt is opened on its first
+    line and stays open until close().
+    """
+
+    def __init__(self, max_bytes=OUTPUT_LOG_MAX_BYTES, backup_count=OUTPUT_LOG_BACKUPS):
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.handlers = {}
+        self.error_files = {}
+        self.lock = threading.Lock()
+
+    def write(self, log_directory, message):
+        with self.lock:
+            handler = self.handlers.get(log_directory)
+            if handler is None:
+                handler = RotatingFileHandler(os.path.join(log_directory, "exiftool_output.txt"),
+                                              maxBytes=self.max_bytes, backupCount=self.backup_count,
+                                              encoding="utf-8", delay=True)
+                # exiftool_output.txt.1 would be picked up by the next scan
+                handler.namer = lambda name: re.sub(r"\.txt\.(\d+)$", r".\1.txt", name)
+                handler.setFormatter(logging.Formatter("%(asctime)s %(threadName)s %(message)s"))
+                self.handlers[log_directory] = handler
+        handler.handle(logging.makeLogRecord({"msg": message, "levelno": logging.INFO, "levelname": "INFO"}))
+
+    def error(self, directory, text):
+        # Append a line to errors.txt in directory
+        with self.lock:
+            error_file = self.error_files.get(directory)
+            if error_file is None:
+                error_file = self.error_files[directory] = open(os.path.join(directory, "errors.txt"), "a",
+                                                                encoding="utf-8")
+            error_file.write(text + "\n")
+
+    def close(self):
+        with self.lock:
+            for handler in self.handlers.values():
+                handler.close()
+            for error_file in self.error_files.values():
+                error_file.close()
+            self.handlers = {}
+            self.error_files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ProgressThrottle:
+    # Passes (done, total) on to callback at most once per interval
+    # seconds, and always once everything is done, so a fast stream of
+    # progress lines doesn't flood the GUI with signals
+    def __init__(self, callback, total, interval=0.2):
+        self.callback = callback
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.last_call = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, count):
+        if not count:
+            return
+        with self.lock:
+            self.done += count
+            now = time.monotonic()
+            if self.done < self.total and now - self.last_call < self.interval:
+                return
+            self.last_call = now
+            done = self.done
+        self.callback(done, self.total)
+
+
+def write_timeout(timeout, paths):
+    # The timeout of a write call over paths, or None to wait forever
+    if timeout is None:
+        return None
+    return timeout + max((file_size(path) for path in paths), default=0) / WRITE_BYTES_PER_SECOND
+
+
+def failed_paths(errors, paths):
+    # The paths exiftool named in its "Error: ... - FILE" lines. An error
+    # that names none of them may concern any file, so then all fail.
+    paths = set(paths)
+    failed = set()
+    for error in errors:
+        path = error.rsplit(" - ", 1)[-1].strip()
+        if path not in paths:
+            return paths
+        failed.add(path)
+    return failed
+
+
+WriteBatch = namedtuple("WriteBatch", ["directory", "log_directory", "records", "pending_bytes"])
+PlannedUpdate = namedtuple("PlannedUpdate", ["directory", "log_directory", "record"])
+
+
+def write_metadata_to_image(directory, records, pool, log_directory, stage_metrics=None, on_files_done=None,
+                            output_logs=None, timeout=None, on_timeout=None, limiter=None):
+    # Write the update records to their files. The records and the list of
+    # files go to exiftool through a temporary JSON file and argfile, so
+    # exiftool touches exactly these files. exiftool's output is read line
+    # by line as it arrives: stdout goes to the rotating
+    # exiftool_output.txt in log_directory and stderr is appended to
+    # errors.txt in the directory. on_files_done is called with the number
+    # of files exiftool finished since the last call. With a timeout, which
+    # write_timeout() extends by the size of the largest file, a batch
+    # exiftool hangs on is bisected and written again; the files that
+    # hang on their own are passed to on_timeout. A retried half may report
+    # files that were already counted, so on_files_done can add up to more
+    # than the number of records. Each call holds a slot of limiter.
+    stage_metrics = stage_metrics or RunMetrics().stage("write")
+    own_logs = output_logs is None
+    output_logs = output_logs or OutputLogs()
+    errors = []
+    files_done = [0]
+
+    def files_started(count):
+        # A progress line means exiftool is done with the files before it
+        if count > files_done[0]:
+            if on_files_done:
+                on_files_done(count - files_done[0])
+            files_done[0] = count
+
+    def on_stdout(line):
+        progress = _PROGRESS_LINE.match(line)
+        if progress:
+            files_started(int(progress.group(1)) - 1)
+        output_logs.write(log_directory, line.decode('utf-8', 'replace'))
+
+    def on_stderr(line):
+        text = line.decode('utf-8', 'replace')
+        output_logs.write(log_directory, f"stderr: {text}")
+        output_logs.error(directory, text)
+        if text.startswith("Error"):
+            errors.append(text)
+
+    def write(batch_records):
+        files_done[0] = 0
+        with tempfile.TemporaryDirectory(prefix="remove-tag-") as temp_directory:
+            metadata_json = os.path.join(temp_directory, "batch.json")
+            argfile = os.path.join(temp_directory, "files.args")
+            with open(metadata_json, "wb") as f:
+                f.write(codec.dumps(batch_records))
+            with open(argfile, "wb") as f:
+                for record in batch_records:
+                    f.write(fsencode(record["SourceFile"]) + b"\n")
+
+            # Run ExifTool from the shared pool to update the metadata.
+            params = WRITE_PARAMS + [f"-json={metadata_json}", "-@", argfile]
+            output_logs.write(log_directory, f"Processing directory: {directory} ({len(batch_records)} files)")
+            paths = [record["SourceFile"] for record in batch_records]
+            with limited_call(limiter, stage_metrics, paths), pool.acquire() as et, \
+                    stage_metrics.measure("exiftool_write"):
+                et.execute_lines(on_stdout, on_stderr, *[fsencode(param) for param in params],
+                                 timeout=write_timeout(timeout, paths))
+        files_started(len(batch_records))
+
+    def timed_out(record):
+        text = f"Error: Timed out, see {QUARANTINE_NAME} - {record['SourceFile']}"
+        output_logs.write(log_directory, text)
+        output_logs.error(directory, text)
+        errors.append(text)
+        if on_timeout:
+            on_timeout(record["SourceFile"])
+
+    try:
+        run_bisecting(records, write, timed_out)
+    finally:
+        if own_logs:
+            output_logs.close()
+    return errors
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def build_write_plan(folder_path):
+    """Map every file listed in a modified.json below the year folders to
+    exactly one PlannedUpdate.
+
+    A file can be listed by several modified.json files when nested folders
+    were scanned on their own as well. The modified.json closest to the file
+    wins, so each file is written once with its most specific update.
+    SourceFile paths are taken as exiftool reported them, so relative ones
+    are relative to the working directory of the scan.
+    Returns the plan and the number of duplicate entries that were dropped.
+    """
+    plan = {}
+    depths = {}
+    duplicates = 0
+    interner = Interner()
+    for year_folder in list_year_folders(folder_path):
+        for root, _, files in os.walk(year_folder):
+            modified_path = codec.find_intermediate(root, "modified.json")
+            if modified_path is None:
+                continue
+
+            depth = os.path.normpath(root).count(os.sep)
+            for item in iter_json_file(modified_path):
+                path = os.path.abspath(item["SourceFile"])
+                if path in plan:
+                    duplicates += 1
+                    if depths[path] >= depth:
+                        continue
+                plan[path] = PlannedUpdate(root, year_folder, interner.compact(dict(item, SourceFile=path)))
+                depths[path] = depth
+    return plan, duplicates
+
+
+def plan_write_batches(plan, batch_size=500):
+    # Cut the planned updates of each directory into batches of at most
+    # batch_size files
+    by_directory = {}
+    for path in sorted(plan):
+        update = plan[path]
+        by_directory.setdefault((update.directory, update.log_directory), []).append(update.record)
+    batches = []
+    for (directory, log_directory), records in by_directory.items():
+        for start in range(0, len(records), batch_size):
+            batch_records = records[start:start + batch_size]
+            pending_bytes = sum(file_size(record["SourceFile"]) for record in batch_records)
+            batches.append(WriteBatch(directory, log_directory, batch_records, pending_bytes))
+    return batches
+
+
+def run_write(folder_path, pool, concurrency=None, batch_size=500, order="bytes", on_batch_done=None,
+              resume=False, metrics=None, on_progress=None, catalog=None, timeout=DEFAULT_TIMEOUT, limiter=None):
+    """Write all pending metadata below folder_path.
+
+    A write plan is built first, so every file is written exactly once.
+    Up to concurrency batches (default: one per pool process) are written
+    at the same time. Batches start largest first, by pending bytes or by
+    file count depending on order, so one huge year is spread over all
+    workers instead of running alone at the end. on_batch_done is called
+    with each finished batch and the number of batches. on_progress is
+    called with the number of files written so far and the total, a few
+    times a second at most, as exiftool reports each file.
+
+    Each finished batch is recorded in the write journal of folder_path.
+    With resume, files whose update is already in the journal are skipped,
+    so an interrupted run continues from its last checkpoint.
+
+    With a catalog, the plan comes from its changed rows instead of the
+    modified.json files, and written files are marked in it.
+
+    A batch exiftool hangs on for timeout seconds, plus a second per MB of
+    its largest file, is bisected as in scan_folders(). The files that hang on their own go to the quarantine
+    list of folder_path and are neither journaled nor marked written;
+    files already on the list are skipped.
+
+    With a concurrency.AdaptiveLimiter, it decides how many of the
+    concurrency batches run exiftool at a time. Returns the error messages.
+    """
+    folder_path = os.path.abspath(folder_path)
+    stage = (metrics or RunMetrics()).stage("write")
+    with stage.timer():
+        return _run_write(folder_path, pool, concurrency, batch_size, order, on_batch_done, resume, stage,
+                          on_progress, catalog, timeout, limiter)
+
+
+def _run_write(folder_path, pool, concurrency, batch_size, order, on_batch_done, resume, stage, on_progress,
+               catalog, timeout, limiter):
+    if catalog is not None:
+        plan = {path: PlannedUpdate(folder, folder, record)
+                for path, (folder, record) in catalog.write_plan().items()}
+    else:
+        plan, duplicates = build_write_plan(folder_path)
+        if duplicates:
+            logger.info("%d files are listed in more than one modified.json; using the closest one", duplicates)
+    journal = WriteJournal.for_folder(folder_path)
+    if resume:
+        completed = journal.completed()
+        done = [path for path, update in plan.items() if completed.get(path) == update_digest(update.record)]
+        for path in done:
+            stage.add(plan.pop(path).directory, skipped=1)
+        logger.info("Resuming: %d files were already written", len(done))
+    quarantine = Quarantine.for_folder(folder_path)
+    quarantined = quarantine.paths() & plan.keys()
+    for path in quarantined:
+        stage.add(plan.pop(path).directory, skipped=1)
+    if quarantined:
+        logger.info("Skipping %d files listed in %s", len(quarantined), quarantine.path)
+    batches = plan_write_batches(plan, batch_size)
+    if order == "files":
+        batches.sort(key=lambda batch: len(batch.records), reverse=True)
+    else:
+        batches.sort(key=lambda batch: batch.pending_bytes, reverse=True)
+
+    # Counts down the batches still waiting as each one starts
+    started = iter(range(len(batches) - 1, -1, -1))
+    progress = ProgressThrottle(on_progress or (lambda done, total: None), len(plan))
+    output_logs = OutputLogs()
+
+    def write_batch(batch):
+        stage.queue_depth("batches", next(started))
+        start = time.perf_counter()
+        reported = [0]
+        # Timed out or refused by exiftool
+        failed = set()
+
+        def files_done(count):
+            # Files of a retried half are reported again
+            count = min(count, len(batch.records) - reported[0])
+            reported[0] += count
+            progress.add(count)
+
+        def timed_out(path):
+            failed.add(path)
+            stage.add(batch.directory, quarantined=1)
+            quarantine.add(path, "write")
+
+        try:
+            with stage.profile():
+                batch_errors = write_metadata_to_image(batch.directory, batch.records, pool, batch.log_directory,
+                                                       stage, files_done, output_logs, timeout, timed_out, limiter)
+                # Files exiftool refused aren't done, so a resumed run
+                # tries them again
+                failed.update(failed_paths(batch_errors, [record["SourceFile"] for record in batch.records]))
+                written = [record for record in batch.records if record["SourceFile"] not in failed]
+                journal.record_batch(written)
+                if catalog is not None:
+                    catalog.mark_written(record["SourceFile"] for record in written)
+        finally:
+            # The files of a failed batch count as done too, so progress
+            # still ends at the total
+            progress.add(len(batch.records) - reported[0])
+        stage.add(batch.directory, processed=len(batch.records), changed=len(batch.records) - len(failed),
+                  bytes_read=batch.pending_bytes,
+                  bytes_written=sum(file_size(record["SourceFile"]) for record in batch.records),
+                  busy_seconds=time.perf_counter() - start)
+        return batch_errors
+
+    errors = []
+    journal.open(resume)
+    with journal, output_logs, ThreadPoolExecutor(max_workers=concurrency or pool.size) as executor:
+        futures = {executor.submit(write_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                errors.extend(future.result())
+            except Exception as e:
+                errors.append(f"Error writing metadata: {batch.directory}\n{str(e)}")
+            if on_batch_done:
+                on_batch_done(batch, len(batches))
+    return errors
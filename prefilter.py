@@ -0,0 +1,125 @@
+"""Skip files whose metadata can't contain any replace pattern.
+
+Most photos carry none of the patterns being removed, but exiftool still
+has to read every one of them. A Prefilter memory-maps a JPEG, walks its
+header segments up to the image data and searches the metadata blocks
+(the EXIF and XMP APP1 segments, the IPTC APP13 segments and comments)
+for the patterns. Only a few KB of each file are touched, and a file
+without a hit never goes to exiftool.
+
+The filter only ever errs towards reading a file:
+- Keep patterns are ignored, so a kept value still makes a candidate.
+- Whole word patterns are searched as plain substrings: the bytes around
+  a value in a block don't mark word boundaries.
+- Files that aren't JPEGs, or can't be read or parsed, are candidates.
+- So are JPEGs with extended XMP, whose packet may be split anywhere.
+- Regex and exact match patterns can't be searched in the raw blocks
+  (an anchor sees the XML around a value, not the value), so with any of
+  them for_matcher() returns no prefilter at all.
+"""
+import html
+import mmap
+from matcher import TagMatcher
+from rules import RuleSet
+
+_SOI = b"\xff\xd8"
+_EXIF = b"Exif\x00\x00"
+_XMP_EXTENSION = b"http://ns.adobe.com/xmp/extension/\x00"
+# APP1 (EXIF, XMP), APP13 (IPTC) and COM segments
+_METADATA_MARKERS = {0xE1, 0xED, 0xFE}
+# Start of scan and end of image: the header is over
+_END_MARKERS = {0xDA, 0xD9}
+# Markers without a length field
+_STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))
+
+
+class Prefilter:
+    """Decides from a file's metadata blocks whether it may need changes.
+
+    matchers are TagMatchers with literal (substring or whole word)
+    patterns; a file is a candidate if any of them finds a pattern.
+    """
+
+    def __init__(self, matchers):
+        self.matchers = [matcher for matcher in matchers if matcher.replace_list]
+
+    @classmethod
+    def for_matcher(cls, matcher):
+        # A Prefilter for a TagMatcher or RuleSet, or None if its patterns
+        # can't be prefiltered safely
+        if isinstance(matcher, RuleSet):
+            matchers = [rule.matcher for rule in matcher.rules]
+        elif isinstance(matcher, TagMatcher):
+            matchers = [matcher]
+        else:
+            return None
+        if any(matcher.regex for matcher in matchers):
+            return None
+        return cls(matchers)
+
+    def is_candidate(self, path):
+        try:
+            text = metadata_text(path)
+        except (OSError, ValueError):
+            return True
+        if text is None:
+            return True
+        return any(matcher.could_match(text) for matcher in self.matchers)
+
+    def split(self, paths):
+        # (candidates, skipped) of paths, in their order
+        candidates, skipped = [], []
+        for path in paths:
+            (candidates if self.is_candidate(path) else skipped).append(path)
+        return candidates, skipped
+
+
+def metadata_text(path):
+    """Return the text of the metadata blocks of a JPEG, or None if the
+    file isn't a JPEG whose blocks can all be searched.
+
+    The blocks are decoded as UTF-8, with and without XML character
+    references resolved, and as Latin-1, since IPTC may be in either.
+    EXIF blocks are decoded as UTF-16 as well, for the Windows XP tags.
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:2] != _SOI:
+                return None
+            blocks = []
+            exif_blocks = []
+            position = 2
+            size = len(data)
+            while position + 4 <= size:
+                if data[position] != 0xFF:
+                    return None
+                marker = data[position + 1]
+                if marker == 0xFF:
+                    # Fill byte
+                    position += 1
+                    continue
+                if marker in _END_MARKERS:
+                    break
+                if marker in _STANDALONE_MARKERS:
+                    position += 2
+                    continue
+                length = int.from_bytes(data[position + 2:position + 4], "big")
+                end = position + 2 + length
+                if length < 2 or end > size:
+                    return None
+                if marker in _METADATA_MARKERS:
+                    block = data[position + 4:end]
+                    if block.startswith(_XMP_EXTENSION):
+                        return None
+                    blocks.append(block)
+                    if block.startswith(_EXIF):
+                        exif_blocks.append(block)
+                position = end
+    raw = b"\n".join(blocks)
+    text = raw.decode("utf-8", "replace")
+    parts = [text, html.unescape(text), raw.decode("latin-1")]
+    for block in exif_blocks:
+        # Either byte order, at either alignment
+        for encoding in ("utf-16-le", "utf-16-be"):
+            parts += [block.decode(encoding, "replace"), block[1:].decode(encoding, "replace")]
+    return "\n".join(parts)
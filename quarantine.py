@@ -0,0 +1,47 @@
+"""List of files that hung exiftool.
+
+A call that runs into its timeout has its exiftool process killed, and
+the batch is split in halves that are retried on their own, down to
+single files (see pipeline.run_bisecting). A file that still times out
+alone is appended to quarantine.txt in the library root, one line per
+file:
+
+    2026-10-18T14:02:11<TAB>write<TAB>/photos/2019/trip/clip.mov
+
+Every stage leaves quarantined files alone; delete a line to have the
+file read and written again.
+"""
+import os
+import time
+import threading
+
+QUARANTINE_NAME = "quarantine.txt"
+
+
+class Quarantine:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_folder(cls, folder_path):
+        return cls(os.path.join(folder_path, QUARANTINE_NAME))
+
+    def paths(self):
+        # The normalized paths of the quarantined files
+        paths = set()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t", 2)
+                    if len(fields) == 3:
+                        paths.add(os.path.normpath(fields[2]))
+        except OSError:
+            pass
+        return paths
+
+    def add(self, path, stage):
+        line = "\t".join([time.strftime("%Y-%m-%dT%H:%M:%S"), stage, os.path.normpath(path)])
+        with self.lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
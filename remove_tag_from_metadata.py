@@ -1,10 +1,13 @@
 import sys
-import os
 from PyQt6.QtWidgets import QApplication, QMainWindow, QMessageBox
 from ui import Ui_Widget
-from PyQt6.QtCore import QThreadPool, QRunnable, pyqtSlot, pyqtSignal, QObject
-from jsonManager import JSONManager, get_list_of_json_files, JsonReplaceWorker
-from metadataWriter import MetadataWriterWorker
+from PyQt6.QtCore import QThreadPool, QTimer
+from jsonManager import JSONManager
+from pipeline import run_replace
+from metadataWriter import MetadataWriterWorker, FusedPipelineWorker
+from exiftool import ExifToolPool
+from matcher import TagMatcher, parse_pattern_list
+from keyword_index import KeywordIndex, format_preview
 # import pydevd_pycharm
 # pydevd_pycharm.settrace('localhost', port=12345, stdoutToServer=True, stderrToServer=True, suspend=False)
 
@@ -16,21 +19,30 @@ class MainWindow(QMainWindow, Ui_Widget):
 
         self.json_manager = JSONManager()
         self.thread_pool = QThreadPool()
+        # Long-lived exiftool processes shared by the scan and write stages
+        self.exiftool_pool = ExifToolPool(common_args=[])
 
         self.loadFolder.clicked.connect(self.select_folder)
         self.processJSON.clicked.connect(self.process_folders)
         self.processJSONButton.clicked.connect(self.process_json_files)
         self.writeMetadataButton.clicked.connect(self.write_metadata)
-
-    def process_next_directory(self, sorted_year_folders):
-        if sorted_year_folders:
-            year_folder_path = sorted_year_folders.pop(0)
-            write_metadata_worker = MetadataWriterWorker(year_folder_path)
-
-            write_metadata_worker.signals.finished.connect(lambda: self.process_next_directory(sorted_year_folders))
-
-            self.thread_pool.setMaxThreadCount(10)
-            self.thread_pool.start(write_metadata_worker)
+        self.runAllButton.clicked.connect(self.run_all_stages)
+
+        # The jsonFiles panel previews the patterns from the keyword index
+        # of the last scan, shortly after the last keystroke
+        self.keyword_index = None
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(300)
+        self.preview_timer.timeout.connect(self.update_preview)
+        for signal in (self.ReplaceText.textChanged, self.notReplace.textChanged, self.caseInsensitiveCheck.toggled,
+                       self.wholeWordCheck.toggled, self.regexCheck.toggled):
+            signal.connect(lambda *args: self.preview_timer.start())
+
+    def closeEvent(self, event):
+        self.thread_pool.waitForDone()
+        self.exiftool_pool.terminate()
+        super().closeEvent(event)
 
     def write_metadata(self):
         parent_directory = self.json_manager.folder_path
@@ -38,22 +50,34 @@ class MainWindow(QMainWindow, Ui_Widget):
             QMessageBox.warning(self, "Error", "Please select a directory first.")
             return
 
-        # Get a sorted list of year folders (from lowest to highest)
-        year_folders = [os.path.join(parent_directory, f) for f in os.listdir(parent_directory) if
-                        os.path.isdir(os.path.join(parent_directory, f)) and f.isdigit()]
-        sorted_year_folders = sorted(year_folders, key=lambda x: int(os.path.basename(x)))
-
-        # Process the directories in chronological order
-        self.process_next_directory(sorted_year_folders)
-
-    def handle_finished_json_processing(self, num_changes, num_errors):
-        self.total_changes += num_changes
-        self.total_errors += num_errors
+        # All year folders are written at once, in batches spread over the
+        # exiftool pool with the largest batches first
+        self.writeMetadataButton.setEnabled(False)
+        self.writeMetadataProgress.setValue(0)
+        self.write_errors = []
+        write_metadata_worker = MetadataWriterWorker(parent_directory, self.exiftool_pool,
+                                                     resume=self.resumeWriteCheck.isChecked())
+        write_metadata_worker.signals.progress.connect(self.update_write_progress)
+        write_metadata_worker.signals.error.connect(self.write_errors.append)
+        write_metadata_worker.signals.finished.connect(self.handle_write_finished)
+        self.thread_pool.start(write_metadata_worker)
+
+    def update_write_progress(self, files_done, num_files):
+        self.writeMetadataProgress.setValue(int(files_done * 100 / num_files))
+        self.writeMetadataProgressLabel.setText(f"{files_done} of {num_files} files written")
+
+    def handle_write_finished(self):
+        self.writeMetadataButton.setEnabled(True)
+        if self.write_errors:
+            QMessageBox.warning(self, "Writing Completed with Errors",
+                                f"{len(self.write_errors)} error(s) occurred. Check errors.txt in the year folders for details.")
 
     def select_folder(self):
         self.json_manager.select_folder()
+        self.keyword_index = None
         if self.json_manager.folder_path:
             self.processJSONProgressLabel.setText(self.json_manager.folder_path)
+            self.preview_timer.start()
 
     def process_folders(self):
         exiftool_command = self.exiftoolCommand.toPlainText()
@@ -71,10 +95,12 @@ class MainWindow(QMainWindow, Ui_Widget):
 
         self.json_manager.process_folders(
             exiftool_command,
+            self.exiftool_pool,
             self.update_progress,
             self.update_progress_label,
             self.handle_error,
-            self.handle_finish
+            self.handle_finish,
+            incremental=self.incrementalScanCheck.isChecked()
         )
 
     def update_progress(self, value):
@@ -92,38 +118,103 @@ class MainWindow(QMainWindow, Ui_Widget):
     def handle_finish(self):
         self.json_manager.on_finish()
         self.processJSON.setEnabled(True)
+        # The scan wrote new keyword indexes
+        self.keyword_index = None
+        self.preview_timer.start()
+
+    def matcher_from_fields(self):
+        # Parse the input from the ReplaceText and notReplace text fields;
+        # raises ValueError for an invalid pattern
+        replace_list = parse_pattern_list(self.ReplaceText.toPlainText())
+        not_replace_list = parse_pattern_list(self.notReplace.toPlainText())
+        return TagMatcher(replace_list, not_replace_list,
+                          case_insensitive=self.caseInsensitiveCheck.isChecked(),
+                          whole_word=self.wholeWordCheck.isChecked(),
+                          regex=self.regexCheck.isChecked())
+
+    def build_matcher(self):
+        # Compile the patterns once for the whole run
+        try:
+            return self.matcher_from_fields()
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return None
+
+    def update_preview(self):
+        if not self.json_manager.folder_path:
+            return
+        if not parse_pattern_list(self.ReplaceText.toPlainText()):
+            self.jsonFiles.setPlainText("")
+            return
+        if self.keyword_index is None:
+            self.keyword_index = KeywordIndex.load(self.json_manager.folder_path)
+        if not self.keyword_index.files:
+            self.jsonFiles.setPlainText("Scan the folder to preview the patterns.")
+            return
+        try:
+            preview = self.keyword_index.preview(self.matcher_from_fields())
+        except ValueError as e:
+            self.jsonFiles.setPlainText(str(e))
+            return
+        self.jsonFiles.setPlainText(format_preview(preview))
 
-    def process_json_files(self):
-        self.total_changes = 0
-        self.total_errors = 0
+    def run_all_stages(self):
+        # Scan, replace and write in one pass without output.json/modified.json
+        exiftool_command = self.exiftoolCommand.toPlainText()
+        if not exiftool_command:
+            QMessageBox.warning(self, "Error", "Please provide a valid exiftool command.")
+            return
 
-        # Get the list of output.json files to process
-        json_files = get_list_of_json_files(self.json_manager.folder_path)
+        if not self.json_manager.folder_path:
+            QMessageBox.warning(self, "Error", "Please select a folder first.")
+            return
 
-        # Parse the input from the ReplaceText and notReplace text fields
-        replace_text = self.ReplaceText.toPlainText()
-        not_replace = self.notReplace.toPlainText()
+        matcher = self.build_matcher()
+        if matcher is None:
+            return
 
-        replace_list = [item.strip() for item in replace_text.split(',')]
-        not_replace_list = [item.strip() for item in not_replace.split(',')]
+        self.runAllButton.setEnabled(False)
+        self.processJSONProgress.setValue(0)
+        self.write_errors = []
+        self.fused_worker = FusedPipelineWorker(self.json_manager.folder_path, exiftool_command,
+                                                self.exiftool_pool, matcher)
+        self.fused_worker.signals.progress.connect(self.update_fused_progress)
+        self.fused_worker.signals.error.connect(self.write_errors.append)
+        self.fused_worker.signals.finished.connect(self.handle_fused_finished)
+        self.thread_pool.start(self.fused_worker)
+
+    def update_fused_progress(self, files_read, num_files):
+        self.processJSONProgress.setValue(int(files_read * 100 / num_files))
+        self.processJSONProgressLabel.setText(f"{files_read} of {num_files} files read")
+
+    def handle_fused_finished(self):
+        self.runAllButton.setEnabled(True)
+        message = (f"{self.fused_worker.total_changes} values removed from "
+                   f"{self.fused_worker.changed_files} files.")
+        if self.write_errors:
+            QMessageBox.warning(self, "Processing Completed with Errors",
+                                f"{message} {len(self.write_errors)} error(s) occurred. Check errors.txt in the year folders for details.")
+        else:
+            QMessageBox.information(self, "Processing Complete", message)
 
-        # Create a QThreadPool to handle multithreading
-        thread_pool = QThreadPool()
+    def process_json_files(self):
+        self.total_changes = 0
+        self.total_errors = 0
 
-        # Create progress and error signals
-        signals = JsonReplaceSignals()
-        signals.progress_signal.connect(self.update_progress)
-        signals.error_signal.connect(self.handle_error)
-        signals.finished_signal.connect(self.handle_finished_json_processing)  # Add this line
+        matcher = self.build_matcher()
+        if matcher is None:
+            return
 
-        # Iterate through the JSON files and process them using multiple threads
-        for file_path in json_files:
-            worker = JsonReplaceWorker(file_path, replace_list, not_replace_list, signals.progress_signal,
-                                       signals.error_signal, signals.finished_signal,)
-            thread_pool.start(worker)
+        # Matching is CPU-bound, so the files are spread over worker
+        # processes, largest first
+        def file_done(file_path, num_changes):
+            self.update_progress(1)
+            QApplication.processEvents()
 
-        # Wait for all the threads to finish
-        thread_pool.waitForDone()
+        self.total_changes, errors = run_replace(self.json_manager.folder_path, matcher, on_file_done=file_done)
+        self.total_errors = len(errors)
+        for error in errors:
+            self.handle_error(error)
 
         # Reset the progress bar and display a message when the processing is complete
         self.jsonProgress.setValue(0)
@@ -134,12 +225,6 @@ class MainWindow(QMainWindow, Ui_Widget):
         )
 
 
-class JsonReplaceSignals(QObject):
-    progress_signal = pyqtSignal(int)
-    error_signal = pyqtSignal(str)
-    finished_signal = pyqtSignal(int, int)  # Add this line
-
-
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = MainWindow()
@@ -0,0 +1,326 @@
+"""Per-tag cleanup rules.
+
+A rule picks tags by name, finds values with a TagMatcher and does one of
+three things with a match: drop the value, strip the matched text from it
+or replace the matched text. Rules are grouped in a RuleSet. The RuleSet
+works out once, for each tag name it meets, which of its rules apply. Tags
+without rules are then skipped without looking at their values. Several
+cleanups that used to need one library cycle each run in one pass, in
+rule order, each rule seeing the result of the previous one.
+
+Rules are written as a JSON list, for example:
+
+    [
+        {"tags": ["XMP:Subject", "IPTC:Keywords"], "patterns": ["Face_"], "keep": ["Family"]},
+        {"tags": ["XMP:Description", "IPTC:Caption-Abstract"], "patterns": ["\\\\s{2,}"],
+         "match": "regex", "action": "replace", "replacement": " "},
+        {"tags": ["XMP:*"], "patterns": ["(copy)"], "action": "strip", "ignore_case": true}
+    ]
+
+A tag selector with a colon is matched against the whole "Group:Tag" key,
+one without against the tag name alone, so "Keywords" finds the tag in
+every group. Selectors may use shell wildcards. The keys only carry their
+group when exiftool is run with -G, as the default scan command is; a rule
+with a group in a selector raises UngroupedTagError on a record without.
+"""
+import re
+import json
+import threading
+from collections import namedtuple
+from itertools import islice
+from fnmatch import fnmatchcase
+from matcher import TagMatcher
+
+ACTIONS = ("drop", "strip", "replace")
+MATCH_TYPES = ("substring", "word", "regex", "exact")
+# Which values of a tag a rule looks at
+VALUE_TYPES = ("all", "list", "scalar")
+
+# Returned by Rule.apply() and RuleSet.apply_value() for a dropped value
+DROP = object()
+
+# The value of a dropped scalar in an update record. exiftool writes an
+# empty value as it is, but deletes a tag set to "-" when run with -f.
+DELETE_VALUE = "-"
+
+RULE_KEYS = ("tags", "patterns", "keep", "match", "action", "replacement", "ignore_case", "values", "name")
+
+# Distinct values whose result each chain of rules remembers. A library has
+# a few ten thousand distinct keywords and names against millions of value
+# occurrences, so this holds all of them in most libraries.
+DECISION_CACHE_SIZE = 1 << 16
+
+# The rules for one tag key. list_chain and scalar_chain are the
+# DecisionCaches of the list and scalar rules. drop_only is set when the
+# list rules only drop items, so the list can be filtered in one pass.
+TagPlan = namedtuple("TagPlan", ["list_rules", "scalar_rules", "list_chain", "scalar_chain", "drop_only"])
+
+
+class UngroupedTagError(ValueError):
+    # A selector names a group, but the record's keys have none
+    pass
+
+
+class Rule:
+    """One cleanup rule.
+
+    tags lists the tag selectors. patterns and keep work as in TagMatcher:
+    a value matches if it contains a pattern and no keep pattern. match is
+    one of MATCH_TYPES, action one of ACTIONS and values one of
+    VALUE_TYPES. A value that strip or replace leaves empty is dropped.
+    A dropped list item is removed from its list. A dropped scalar is set
+    to DELETE_VALUE, so the write stage deletes the tag. tags, patterns and
+    keep are lists of strings, or a single string.
+    """
+
+    def __init__(self, tags, patterns, keep=(), match="substring", action="drop", replacement="",
+                 ignore_case=False, values="all", name=None, matcher=None):
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown action: {action}")
+        if match not in MATCH_TYPES:
+            raise ValueError(f"Unknown match type: {match}")
+        if values not in VALUE_TYPES:
+            raise ValueError(f"Unknown value type: {values}")
+        tags, patterns, keep = (_string_list(tags, "tags"), _string_list(patterns, "patterns"),
+                                _string_list(keep, "keep"))
+        self.tags = tags
+        self.action = action
+        self.replacement = "" if action == "strip" else replacement
+        self.values = values
+        self.name = name or f"{action} {', '.join(patterns)}"
+        if matcher is None:
+            if match == "exact":
+                patterns = [rf"\A(?:{re.escape(pattern)})\Z" for pattern in patterns]
+                keep = [rf"\A(?:{re.escape(pattern)})\Z" for pattern in keep]
+            matcher = TagMatcher(list(patterns), list(keep), case_insensitive=ignore_case,
+                                 whole_word=match == "word", regex=match in ("regex", "exact"))
+        self.matcher = matcher
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise ValueError(f"Invalid rule {data!r}: a rule is a JSON object")
+        unknown = sorted(set(data) - set(RULE_KEYS))
+        if unknown:
+            raise ValueError(f"Invalid rule {data!r}: unknown keys {', '.join(unknown)}")
+        fields = dict(data)
+        try:
+            return cls(fields.pop("tags"), fields.pop("patterns"), **fields)
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Invalid rule {data!r}: {e}") from e
+
+    def applies_to(self, tag):
+        if ":" not in tag and any(":" in selector for selector in self.tags):
+            raise UngroupedTagError(f"Rule {self.name!r} selects tags by group, but the records have no groups "
+                                    f"(found {tag!r}); scan with exiftool -G")
+        group_tag = tag.lower()
+        name = group_tag.rsplit(":", 1)[-1]
+        for selector in self.tags:
+            selector = selector.lower()
+            if fnmatchcase(group_tag if ":" in selector else name, selector):
+                return True
+        return False
+
+    def apply(self, value):
+        # Returns the new value, or DROP
+        if self.action == "drop":
+            return DROP if self.matcher.should_remove(value) else value
+        if self.action == "strip":
+            # Don't leave the spaces around the stripped text behind
+            new_value = self.matcher.strip(value)
+        else:
+            new_value = self.matcher.substitute(value, self.replacement)
+        if new_value == value:
+            return value
+        if not new_value.strip():
+            return DROP
+        return new_value
+
+
+def _string_list(value, field):
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, (list, tuple)) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"{field} must be a string or a list of strings, not {value!r}")
+    return list(value)
+
+
+class DecisionCache:
+    """Memoized results of one chain of rules, for at most max_size values.
+
+    Calling it returns the new value of a string, or DROP. A hit is a
+    single dict lookup and isn't recorded, which keeps it cheaper than the
+    regex it saves; functools.lru_cache relinks its list on every hit and
+    measured slower than matching. When the cache is full the oldest
+    quarter of the entries is evicted. Hot loops call get() and fall back
+    to miss() themselves.
+    """
+
+    def __init__(self, function, max_size):
+        self.function = function
+        self.max_size = max(1, max_size)
+        self.results = {}
+        self.get = self.results.get
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, value):
+        result = self.get(value)
+        if result is None:
+            result = self.miss(value)
+        return result
+
+    def miss(self, value):
+        result = self.get(value)
+        if result is not None:
+            # An empty string, which is falsy for callers using get() or miss()
+            return result
+        result = self.function(value)
+        with self.lock:
+            self.misses += 1
+            if len(self.results) >= self.max_size:
+                for key in list(islice(self.results, self.max_size // 4 or 1)):
+                    del self.results[key]
+            self.results[value] = result
+        return result
+
+
+class RuleSet:
+    """An ordered list of rules, applied to whole records.
+
+    The dispatch plan maps each tag key seen so far to the rules that
+    apply to it, split into those for list values and those for scalars.
+    It is built on first sight of a key, so the selectors are matched
+    once per tag key and not once per record. Lists whose rules only drop
+    items, like the GUI's replace list, take a shortcut that filters them
+    in one comprehension.
+
+    The result of each chain of rules is memoized per value in a
+    DecisionCache of cache_size entries, shared by all tags with the same rules,
+    so a keyword found in thousands of records is matched once.
+    """
+
+    def __init__(self, rules, cache_size=DECISION_CACHE_SIZE):
+        self.rules = list(rules)
+        self.cache_size = cache_size
+        self._plan = {}
+        self._chains = {}
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        if not isinstance(data, list):
+            raise ValueError("A rules file holds a JSON list of rules")
+        return cls(Rule.from_dict(item) for item in data)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls.from_json(f.read())
+
+    @classmethod
+    def from_matcher(cls, matcher):
+        # The replace/keep lists of the GUI and CLI: drop matching items of
+        # every list-valued tag, and leave scalars alone
+        return cls([Rule(["*"], matcher.replace_list, matcher.not_replace_list, values="list",
+                         name="remove matching list items", matcher=matcher)])
+
+    def __getstate__(self):
+        # The plan and the decision caches are rebuilt in worker processes
+        # rather than pickled
+        return {"rules": self.rules, "cache_size": self.cache_size}
+
+    def __setstate__(self, state):
+        self.rules = state["rules"]
+        self.cache_size = state["cache_size"]
+        self._plan = {}
+        self._chains = {}
+
+    def plan_for(self, tag):
+        plan = self._plan.get(tag)
+        if plan is None:
+            rules = [rule for rule in self.rules if tag != "SourceFile" and rule.applies_to(tag)]
+            list_rules = tuple(rule for rule in rules if rule.values != "scalar")
+            scalar_rules = tuple(rule for rule in rules if rule.values != "list")
+            drop_only = bool(list_rules) and all(rule.action == "drop" for rule in list_rules)
+            plan = self._plan[tag] = TagPlan(list_rules, scalar_rules, self._chain(list_rules),
+                                             self._chain(scalar_rules), drop_only)
+        return plan
+
+    def _chain(self, rules):
+        chain = self._chains.get(rules)
+        if chain is None:
+            chain = self._chains[rules] = DecisionCache(lambda value: self.apply_value(value, rules), self.cache_size)
+        return chain
+
+    def cache_info(self):
+        # Misses and entries summed over the decision caches
+        return {"misses": sum(chain.misses for chain in self._chains.values()),
+                "size": sum(len(chain.results) for chain in self._chains.values())}
+
+    def apply_value(self, value, rules):
+        # Returns the new value, or DROP
+        for rule in rules:
+            value = rule.apply(value)
+            if value is DROP:
+                break
+        return value
+
+    def apply(self, image_data):
+        """Return the number of removed or changed values and a record holding
+        the SourceFile and only the tags that changed, or None if nothing did.
+        """
+        count = 0
+        change = None
+        for tag, value in image_data.items():
+            list_rules, scalar_rules, list_chain, scalar_chain, drop_only = self.plan_for(tag)
+            if isinstance(value, list):
+                if not list_rules:
+                    continue
+                if drop_only:
+                    num_changed, new_value = self._drop_items(value, list_chain)
+                else:
+                    num_changed, new_value = self._apply_items(value, list_chain)
+                if not num_changed:
+                    continue
+                count += num_changed
+            elif isinstance(value, str) and scalar_rules:
+                new_value = scalar_chain(value)
+                if new_value is not DROP and new_value == value:
+                    continue
+                count += 1
+                if new_value is DROP:
+                    new_value = DELETE_VALUE
+            else:
+                continue
+            if change is None:
+                change = {"SourceFile": image_data["SourceFile"]}
+            change[tag] = new_value
+        return count, change
+
+    @staticmethod
+    def _drop_items(value, chain):
+        # Only strings can match, and only strings are hashable for certain.
+        # A cached result is a string or DROP, so a falsy get() is a miss.
+        get, miss = chain.get, chain.miss
+        new_value = [item for item in value if item.__class__ is not str or (get(item) or miss(item)) is not DROP]
+        return len(value) - len(new_value), new_value
+
+    @staticmethod
+    def _apply_items(value, chain):
+        num_changed = 0
+        new_value = []
+        for item in value:
+            new_item = chain(item) if isinstance(item, str) else item
+            if new_item is DROP or new_item != item:
+                num_changed += 1
+            if new_item is not DROP:
+                new_value.append(new_item)
+        return num_changed, new_value
+
+
+def as_ruleset(matcher):
+    # process_record() and friends take a RuleSet or a legacy TagMatcher
+    if isinstance(matcher, RuleSet):
+        return matcher
+    return RuleSet.from_matcher(matcher)
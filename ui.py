@@ -1,5 +1,6 @@
 from PyQt6 import QtWidgets, QtGui, QtCore
 from jsonManager import JSONManager
+from pipeline import DEFAULT_SCAN_COMMAND
 
 class Ui_Widget(object):
     def setupUi(self, Widget):
@@ -22,6 +23,13 @@ class Ui_Widget(object):
         self.processJSON = QtWidgets.QPushButton(parent=self.commandTab)
         self.processJSON.setGeometry(QtCore.QRect(680, 480, 100, 32))
         self.processJSON.setObjectName("processJSON")
+        self.runAllButton = QtWidgets.QPushButton(parent=self.commandTab)
+        self.runAllButton.setGeometry(QtCore.QRect(840, 480, 140, 32))
+        self.runAllButton.setObjectName("runAllButton")
+        self.incrementalScanCheck = QtWidgets.QCheckBox(parent=self.commandTab)
+        self.incrementalScanCheck.setGeometry(QtCore.QRect(520, 440, 260, 20))
+        self.incrementalScanCheck.setChecked(True)
+        self.incrementalScanCheck.setObjectName("incrementalScanCheck")
         self.processJSONProgress = QtWidgets.QProgressBar(parent=self.commandTab)
         self.processJSONProgress.setGeometry(QtCore.QRect(70, 530, 1211, 23))
         self.processJSONProgress.setProperty("value", 0)
@@ -47,9 +55,19 @@ class Ui_Widget(object):
         self.notReplace.setObjectName("notReplace")
         self.jsonFiles = QtWidgets.QPlainTextEdit(parent=self.replaceMetadataTab)
         self.jsonFiles.setGeometry(QtCore.QRect(630, 30, 621, 571))
+        self.jsonFiles.setReadOnly(True)
         self.jsonFiles.setObjectName("jsonFiles")
+        self.caseInsensitiveCheck = QtWidgets.QCheckBox(parent=self.replaceMetadataTab)
+        self.caseInsensitiveCheck.setGeometry(QtCore.QRect(180, 150, 231, 20))
+        self.caseInsensitiveCheck.setObjectName("caseInsensitiveCheck")
+        self.wholeWordCheck = QtWidgets.QCheckBox(parent=self.replaceMetadataTab)
+        self.wholeWordCheck.setGeometry(QtCore.QRect(180, 175, 231, 20))
+        self.wholeWordCheck.setObjectName("wholeWordCheck")
+        self.regexCheck = QtWidgets.QCheckBox(parent=self.replaceMetadataTab)
+        self.regexCheck.setGeometry(QtCore.QRect(180, 200, 231, 20))
+        self.regexCheck.setObjectName("regexCheck")
         self.processJSONButton = QtWidgets.QPushButton(parent=self.replaceMetadataTab)
-        self.processJSONButton.setGeometry(QtCore.QRect(230, 160, 100, 32))
+        self.processJSONButton.setGeometry(QtCore.QRect(230, 235, 100, 32))
         self.processJSONButton.setObjectName("processJSONButton")
         self.jsonProgress = QtWidgets.QProgressBar(parent=self.replaceMetadataTab)
         self.jsonProgress.setGeometry(QtCore.QRect(37, 490, 551, 23))
@@ -73,6 +91,9 @@ class Ui_Widget(object):
         self.writeMetadataFolderList = QtWidgets.QPlainTextEdit(parent=self.writeMetadataTab)
         self.writeMetadataFolderList.setGeometry(QtCore.QRect(60, 50, 1201, 451))
         self.writeMetadataFolderList.setObjectName("writeMetadataFolderList")
+        self.resumeWriteCheck = QtWidgets.QCheckBox(parent=self.writeMetadataTab)
+        self.resumeWriteCheck.setGeometry(QtCore.QRect(60, 510, 400, 20))
+        self.resumeWriteCheck.setObjectName("resumeWriteCheck")
         self.writeMetadataButton = QtWidgets.QPushButton(parent=self.writeMetadataTab)
         self.writeMetadataButton.setGeometry(QtCore.QRect(620, 610, 100, 32))
         self.writeMetadataButton.setObjectName("writeMetadataButton")
@@ -82,8 +103,7 @@ class Ui_Widget(object):
         self.tabWidget.setCurrentIndex(0)
         self.replaceMetadataTab.setEnabled(True)
         self.writeMetadataTab.setEnabled(True)
-        self.exiftoolCommand.setPlainText(
-            "exiftool -r -progress -j --ext .txt --ext .csv --ext .db --ext .args --ext .json -exif:DateTimeOriginal -exif:ModifyDate -exif:Model -exif:CameraModelName -exif:ISO -exif:Notes -exif:ImageDescription -exif:UserComment -exif:GPSLongitude -exif:GPSLatitude -iptc:Sub-location -iptc:City -iptc:Province-State -iptc:Country-PrimaryLocationName -iptc:Category -iptc:Headline -iptc:Caption -iptc:Source -iptc:Caption-Abstract -iptc:Notes -iptc:FixtureIdentifier -iptc:Contact -iptc:Keywords -xmp:Event -xmp:Location -xmp:Sub-location -xmp:City -xmp:Province-State -xmp:Country-PrimaryLocationName -xmp:Description -xmp:UserComment -xmp:Keywords -xmp:People -xmp:PersonInImage -xmp:TagsList -xmp:CatalogSets -xmp:HierarchicalSubject -xmp:RegionAppliedToDimensions -xmp:RegionArea -xmp:RegionExtensions -xmp:RegionName -xmp:RegionPersonDisplayName -xmp:RegionRectangle -xmp:RegionType -xmp:RegionUnit")
+        self.exiftoolCommand.setPlainText(DEFAULT_SCAN_COMMAND)
         font = QtGui.QFont()
         font.setPointSize(24)
         self.exiftoolCommand.setFont(font)
@@ -98,13 +118,19 @@ class Ui_Widget(object):
         self.label.setText(_translate("Widget", "Remove Metadata from Library"))
         self.loadFolder.setText(_translate("Widget", "Load Folder"))
         self.processJSON.setText(_translate("Widget", "Process JSON"))
+        self.runAllButton.setText(_translate("Widget", "Run All Stages"))
+        self.incrementalScanCheck.setText(_translate("Widget", "Only rescan new or changed files"))
         self.processJSONProgressLabel.setText(_translate("Widget", "Output"))
         self.tabWidget.setTabText(self.tabWidget.indexOf(self.commandTab), _translate("Widget", "Command"))
         self.replaceTextLabel.setText(_translate("Widget", "Text to Replace"))
         self.notReplaceTextLabel.setText(_translate("Widget", "Text Not to Replace"))
+        self.caseInsensitiveCheck.setText(_translate("Widget", "Ignore case"))
+        self.wholeWordCheck.setText(_translate("Widget", "Whole words only"))
+        self.regexCheck.setText(_translate("Widget", "Patterns are regular expressions"))
         self.processJSONButton.setText(_translate("Widget", "Process JSON"))
         self.jsonProgressLabel.setText(_translate("Widget", "TextLabel"))
         self.tabWidget.setTabText(self.tabWidget.indexOf(self.replaceMetadataTab), _translate("Widget", "Replace Metadata"))
         self.writeMetadataProgressLabel.setText(_translate("Widget", "TextLabel"))
+        self.resumeWriteCheck.setText(_translate("Widget", "Resume the previous write run"))
         self.writeMetadataButton.setText(_translate("Widget", "Write Metadata"))
         self.tabWidget.setTabText(self.tabWidget.indexOf(self.writeMetadataTab), _translate("Widget", "Write Metadata"))